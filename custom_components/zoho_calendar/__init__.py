@@ -16,7 +16,13 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     await coordinator.async_config_entry_first_refresh()
 
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = coordinator
+    entry.async_on_unload(coordinator.cancel_event_timer)
     await hass.config_entries.async_forward_entry_setups(entry, [SENSOR_PLATFORM])
+
+    # Push delle modifiche dall'add-on (cancellato automaticamente all'unload)
+    entry.async_create_background_task(
+        hass, coordinator.async_listen_changes(), "zoho_calendar_stream"
+    )
     return True
 
 
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+from collections.abc import AsyncIterator
+import json
 import logging
 
-from aiohttp import ClientError
+from aiohttp import ClientError, ClientResponseError, ClientTimeout
+
+from .const import STREAM_READ_TIMEOUT
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -22,6 +26,48 @@ class ZohoCalendarApi:
     async def get_events_today(self) -> dict:
         return await self._get_json("/api/events")
 
+    async def get_snapshot(self, etag: str | None = None) -> tuple[dict | None, str | None]:
+        """Snapshot aggregato; restituisce (None, etag) se invariato (304)."""
+        url = f"{self._base_url}/api/snapshot"
+        headers = {"If-None-Match": etag} if etag else {}
+        try:
+            async with self._session.get(url, headers=headers, timeout=30) as resp:
+                if resp.status == 304:
+                    return None, etag
+                resp.raise_for_status()
+                return await resp.json(), resp.headers.get("ETag")
+        except ClientResponseError as err:
+            if err.status != 404:
+                _LOGGER.error("Errore chiamata API %s: %s", url, err)
+            raise
+        except (ClientError, asyncio.TimeoutError) as err:
+            _LOGGER.error("Errore chiamata API %s: %s", url, err)
+            raise
+
+    async def stream_changes(self) -> AsyncIterator[tuple[str, dict]]:
+        """Legge lo stream SSE /api/stream, restituendo coppie (evento, dati)."""
+        url = f"{self._base_url}/api/stream"
+        timeout = ClientTimeout(total=None, sock_read=STREAM_READ_TIMEOUT)
+        headers = {"Accept": "text/event-stream"}
+        async with self._session.get(url, headers=headers, timeout=timeout) as resp:
+            resp.raise_for_status()
+            event, data = "message", []
+            async for raw in resp.content:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    if data:
+                        yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+                    continue
+                if line.startswith(":"):
+                    continue
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+
     async def _get_json(self, path: str) -> dict:
         url = f"{self._base_url}{path}"
         try:
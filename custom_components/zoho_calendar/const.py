@@ -7,4 +7,9 @@ CONF_UPDATE_INTERVAL = "update_interval"
 DEFAULT_BASE_URL = "http://addon_zoho-calendar:8099"
 DEFAULT_UPDATE_INTERVAL = 60
 
+# Stream SSE dell'add-on (push delle modifiche)
+STREAM_READ_TIMEOUT = 90
+STREAM_RETRY_MIN = 5
+STREAM_RETRY_MAX = 300
+
 SENSOR_PLATFORM = "sensor"
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
-from datetime import timedelta
+import asyncio
+from datetime import datetime, timedelta
 import logging
 
-from homeassistant.core import HomeAssistant
+from aiohttp import ClientError, ClientResponseError
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_point_in_time
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util import dt as dt_util
 
 from .api import ZohoCalendarApi
-from .const import DEFAULT_UPDATE_INTERVAL
+from .const import DEFAULT_UPDATE_INTERVAL, STREAM_RETRY_MAX, STREAM_RETRY_MIN
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -20,28 +25,190 @@ class ZohoCalendarCoordinator(DataUpdateCoordinator):
         self.use_addon_interval = use_addon_interval
         self.interval = interval
         self.api = ZohoCalendarApi(async_get_clientsession(hass), base_url)
+        self._etag = None
+        self._snapshot_supported = True
+        self.index = ZohoCalendarIndex({})
+        self._unsub_event_start = None
         super().__init__(
             hass,
             _LOGGER,
             name="zoho_calendar",
             update_interval=timedelta(seconds=interval or DEFAULT_UPDATE_INTERVAL),
+            # Con snapshot invariato (304) le entita' non vengono aggiornate:
+            # il prossimo evento cambia con l'orario, vedi _schedule_event_start
+            always_update=False,
         )
 
     async def _async_update_data(self) -> dict:
         try:
-            status = await self.api.get_config_status()
-            if self.use_addon_interval:
-                addon_interval = int(status.get("update_interval", self.interval or DEFAULT_UPDATE_INTERVAL))
-                if addon_interval > 0 and addon_interval != self.update_interval.total_seconds():
-                    self.update_interval = timedelta(seconds=addon_interval)
-
-            technicians = await self.api.get_technicians()
-            events = await self.api.get_events_today()
-            return {
-                "status": status,
-                "technicians": technicians.get("data", []),
-                "events": events.get("data", []),
-                "last_sync": events.get("last_sync"),
-            }
+            if self._snapshot_supported:
+                try:
+                    data = await self._fetch_snapshot()
+                except ClientResponseError as err:
+                    if err.status != 404:
+                        raise
+                    # Add-on senza /api/snapshot: usa le chiamate separate
+                    _LOGGER.info("Endpoint snapshot non disponibile, uso API separate")
+                    self._snapshot_supported = False
+                    data = await self._fetch_legacy()
+            else:
+                data = await self._fetch_legacy()
+
+            self._apply_addon_interval(data["status"])
+            if data is not self.data:
+                self.index = ZohoCalendarIndex(data)
+                self._schedule_event_start()
+            return data
         except Exception as err:
             raise UpdateFailed(str(err)) from err
+
+    def _schedule_event_start(self) -> None:
+        """Aggiorna le entita' all'inizio del prossimo evento di oggi.
+
+        Il prossimo evento dipende dall'orario: con eventi consecutivi lo
+        snapshot resta invariato (304) ma il sensore deve avanzare.
+        """
+        self.cancel_event_timer()
+        when = self.index.next_start(dt_util.now())
+        if when is not None:
+            self._unsub_event_start = async_track_point_in_time(
+                self.hass, self._handle_event_start, when + timedelta(seconds=1)
+            )
+
+    @callback
+    def _handle_event_start(self, _now: datetime) -> None:
+        self._unsub_event_start = None
+        self.async_update_listeners()
+        self._schedule_event_start()
+
+    @callback
+    def cancel_event_timer(self) -> None:
+        if self._unsub_event_start:
+            self._unsub_event_start()
+            self._unsub_event_start = None
+
+    async def async_listen_changes(self) -> None:
+        """Ascolta lo stream dell'add-on e aggiorna subito a ogni modifica.
+
+        In caso di errore si riconnette con backoff; nel frattempo resta
+        attivo il normale polling del coordinator.
+        """
+        delay = STREAM_RETRY_MIN
+        reconnect = False
+        while True:
+            try:
+                async for event, _data in self.api.stream_changes():
+                    if event == "hello":
+                        if reconnect:
+                            # Riconnessi: recupera eventuali modifiche perse
+                            await self.async_request_refresh()
+                        reconnect = True
+                        delay = STREAM_RETRY_MIN
+                    elif event == "change":
+                        await self.async_request_refresh()
+            except asyncio.CancelledError:
+                raise
+            except ClientResponseError as err:
+                if err.status == 404:
+                    _LOGGER.info("Stream add-on non disponibile, solo polling")
+                    return
+                _LOGGER.debug("Stream add-on interrotto: %s", err)
+            except (ClientError, asyncio.TimeoutError, ValueError) as err:
+                _LOGGER.debug("Stream add-on interrotto: %s", err)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RETRY_MAX)
+
+    async def _fetch_snapshot(self) -> dict:
+        snapshot, self._etag = await self.api.get_snapshot(self._etag)
+        if snapshot is None and self.data is not None:
+            return self.data
+        if snapshot is None:
+            # 304 senza dati locali (non dovrebbe accadere): ricarica completa
+            snapshot, self._etag = await self.api.get_snapshot()
+        return {
+            "status": snapshot.get("status", {}),
+            "technicians": snapshot.get("technicians", []),
+            "events": snapshot.get("events", []),
+            "last_sync": snapshot.get("last_sync"),
+        }
+
+    async def _fetch_legacy(self) -> dict:
+        status = await self.api.get_config_status()
+        technicians = await self.api.get_technicians()
+        events = await self.api.get_events_today()
+        return {
+            "status": status,
+            "technicians": technicians.get("data", []),
+            "events": events.get("data", []),
+            "last_sync": events.get("last_sync"),
+        }
+
+    def _apply_addon_interval(self, status: dict) -> None:
+        if not self.use_addon_interval:
+            return
+        addon_interval = int(status.get("update_interval", self.interval or DEFAULT_UPDATE_INTERVAL))
+        if addon_interval > 0 and addon_interval != self.update_interval.total_seconds():
+            self.update_interval = timedelta(seconds=addon_interval)
+
+
+class ZohoCalendarIndex:
+    """Indice per tecnico costruito una volta per refresh.
+
+    Tecnici per nome ed eventi di oggi per tecnico ordinati per orario di
+    inizio, con un puntatore al prossimo evento che avanza col tempo.
+    """
+
+    def __init__(self, data: dict, now: datetime | None = None) -> None:
+        self.technicians = {
+            tech.get("name"): tech for tech in data.get("technicians", [])
+        }
+
+        # Snapshot ed /api/events contengono solo eventi di oggi; il campo
+        # "date" e' il valore Zoho originale (es. "18/10/2026"), non ISO
+        now = now or dt_util.now()
+        events: dict[str, list[tuple[datetime, dict]]] = {}
+        for ev in data.get("events", []):
+            start = _parse_time(ev.get("start_time"), now)
+            if start:
+                events.setdefault(ev.get("technician"), []).append((start, ev))
+        for items in events.values():
+            items.sort(key=lambda x: x[0])
+        self._events = events
+        self._next = dict.fromkeys(events, 0)
+
+    def get_technician(self, name: str) -> dict | None:
+        return self.technicians.get(name)
+
+    def next_start(self, now: datetime) -> datetime | None:
+        """Primo inizio evento successivo a `now`, tra tutti i tecnici."""
+        starts = [
+            start for items in self._events.values()
+            for start, _ev in items if start > now
+        ]
+        return min(starts, default=None)
+
+    def next_event(self, name: str) -> dict | None:
+        """Prossimo evento di oggi del tecnico (inizio >= adesso)."""
+        items = self._events.get(name)
+        if not items:
+            return None
+        now = dt_util.now()
+        i = self._next[name]
+        while i < len(items) and items[i][0] < now:
+            i += 1
+        self._next[name] = i
+        return items[i][1] if i < len(items) else None
+
+
+def _parse_time(time_str, ref):
+    if not time_str:
+        return None
+    try:
+        # Accetta anche "DD/MM/YYYY HH:MM" (formato Zoho)
+        parts = time_str.rsplit(" ", 1)[-1].split(":")
+        hour = int(parts[0])
+        minute = int(parts[1]) if len(parts) > 1 else 0
+        return ref.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    except (ValueError, IndexError):
+        return None
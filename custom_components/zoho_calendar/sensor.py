@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-from datetime import datetime, date
 import logging
 
 from homeassistant.components.sensor import SensorEntity
@@ -8,7 +7,6 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
-from homeassistant.util import dt as dt_util
 
 from .const import DOMAIN
 from .coordinator import ZohoCalendarCoordinator
@@ -71,7 +69,8 @@ class ZohoTechnicianSensor(ZohoBaseSensor):
 
     @property
     def native_value(self):
-        tech = self._find_tech()
+        index = self.coordinator.index
+        tech = index.get_technician(self._tech_name)
         if not tech:
             return None
         if self._key == "status":
@@ -79,7 +78,7 @@ class ZohoTechnicianSensor(ZohoBaseSensor):
         if self._key == "events_count":
             return tech.get("events_count")
         if self._key in ("next_title", "next_time"):
-            next_ev = _find_next_event(self.coordinator.data.get("events", []), self._tech_name)
+            next_ev = index.next_event(self._tech_name)
             if not next_ev:
                 return None
             if self._key == "next_title":
@@ -87,41 +86,3 @@ class ZohoTechnicianSensor(ZohoBaseSensor):
             return next_ev.get("start_time")
         return None
 
-    def _find_tech(self):
-        data = self.coordinator.data or {}
-        for tech in data.get("technicians", []):
-            if tech.get("name") == self._tech_name:
-                return tech
-        return None
-
-
-def _find_next_event(events, tech_name: str):
-    if not events:
-        return None
-    now = dt_util.now()
-    today_str = date.today().isoformat()
-    candidates = []
-    for ev in events:
-        if ev.get("technician") != tech_name:
-            continue
-        if ev.get("date") != today_str:
-            continue
-        start = _parse_time(ev.get("start_time"), now)
-        if start and start >= now:
-            candidates.append((start, ev))
-    if not candidates:
-        return None
-    candidates.sort(key=lambda x: x[0])
-    return candidates[0][1]
-
-
-def _parse_time(time_str, ref):
-    if not time_str:
-        return None
-    try:
-        parts = time_str.split(":")
-        hour = int(parts[0])
-        minute = int(parts[1]) if len(parts) > 1 else 0
-        return ref.replace(hour=hour, minute=minute, second=0, microsecond=0)
-    except (ValueError, IndexError):
-        return None
@@ -0,0 +1,52 @@
+"""Indice eventi del coordinator con i valori di data/ora restituiti da Zoho."""
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.zoho_calendar import coordinator  # noqa: E402
+from custom_components.zoho_calendar.coordinator import ZohoCalendarIndex  # noqa: E402
+
+NOW = datetime(2026, 10, 18, 11, 0)
+
+# Eventi consecutivi come li espone l'add-on: "date" e orari in formato Zoho
+DATA = {
+    "technicians": [{"id": "1", "name": "Mario Rossi", "status": "occupato"}],
+    "events": [
+        {
+            "id": "1", "title": "Cantiere A", "technician": "Mario Rossi",
+            "date": "18/10/2026",
+            "start_time": "18/10/2026 10:00", "end_time": "18/10/2026 12:00",
+        },
+        {
+            "id": "2", "title": "Cantiere B", "technician": "Mario Rossi",
+            "date": "18-Oct-2026",
+            "start_time": "18-Oct-2026 12:00:00", "end_time": "18-Oct-2026 14:00:00",
+        },
+    ],
+}
+
+
+def test_zoho_dates_are_indexed():
+    index = ZohoCalendarIndex(DATA, now=NOW)
+    assert index.next_start(NOW) == NOW.replace(hour=12)
+
+
+def test_next_event_advances_at_event_start(monkeypatch):
+    index = ZohoCalendarIndex(DATA, now=NOW)
+
+    monkeypatch.setattr(coordinator.dt_util, "now", lambda: NOW)
+    assert index.next_event("Mario Rossi")["id"] == "2"
+
+    after_start = NOW.replace(hour=12, minute=1)
+    monkeypatch.setattr(coordinator.dt_util, "now", lambda: after_start)
+    assert index.next_event("Mario Rossi") is None
+    assert index.next_start(after_start) is None
+
+
+def test_time_only_values():
+    data = {"events": [{"technician": "Luca Bianchi", "start_time": "15:30"}]}
+    index = ZohoCalendarIndex(data, now=NOW)
+    assert index.next_start(NOW) == NOW.replace(hour=15, minute=30)
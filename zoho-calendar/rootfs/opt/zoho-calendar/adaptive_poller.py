@@ -0,0 +1,119 @@
+"""
+Adaptive Poller
+
+Calcola l'intervallo di polling verso Zoho in base a orario lavorativo,
+frequenza recente delle modifiche, errori (backoff esponenziale) e segnali
+di rate limit, sempre entro un minimo e un massimo configurati.
+"""
+
+import logging
+import threading
+from datetime import datetime, time as dtime
+
+logger = logging.getLogger(__name__)
+
+# Fattori applicati all'intervallo base
+OFF_HOURS_FACTOR = 5
+IDLE_STEP = 1.25
+IDLE_MAX_FACTOR = 4
+BUSY_FACTOR = 0.5
+RATE_LIMIT_FACTOR = 4
+MAX_ERROR_EXPONENT = 6
+
+
+def parse_business_hours(value):
+    """'07:00-19:00' -> (time(7, 0), time(19, 0)); None se vuoto o non valido."""
+    try:
+        start, end = (part.strip() for part in value.split("-", 1))
+        return (
+            datetime.strptime(start, "%H:%M").time(),
+            datetime.strptime(end, "%H:%M").time(),
+        )
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_business_days(value):
+    """'1,2,3,4,5' -> {1, 2, 3, 4, 5} (giorni ISO, lunedi' = 1)."""
+    try:
+        return {int(d) for d in str(value).split(",") if d.strip()}
+    except ValueError:
+        return {1, 2, 3, 4, 5}
+
+
+class AdaptivePoller:
+    def __init__(self, base_interval, min_interval, max_interval,
+                 business_hours=None, business_days=None, enabled=True):
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.business_hours = business_hours
+        self.business_days = business_days or {1, 2, 3, 4, 5}
+        self.enabled = enabled
+
+        self._idle_factor = 1.0
+        self._errors = 0
+        self._rate_limited = False
+        self._extra_factor = 1.0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Segnali
+    # ------------------------------------------------------------------
+
+    def record_success(self, changed):
+        """Sync riuscita: se nulla e' cambiato l'intervallo cresce gradualmente."""
+        with self._lock:
+            self._errors = 0
+            self._rate_limited = False
+            if changed:
+                self._idle_factor = BUSY_FACTOR
+            else:
+                self._idle_factor = min(
+                    max(self._idle_factor, 1.0) * IDLE_STEP, IDLE_MAX_FACTOR
+                )
+
+    def record_error(self, status_code=None):
+        """Sync fallita: backoff esponenziale, piu' marcato sul rate limit (429)."""
+        with self._lock:
+            self._errors += 1
+            if status_code == 429:
+                self._rate_limited = True
+
+    def set_extra_factor(self, factor):
+        """Fattore esterno (es. budget API in esaurimento), 1 = nessun effetto."""
+        with self._lock:
+            self._extra_factor = max(factor, 1.0)
+
+    # ------------------------------------------------------------------
+    # Intervallo
+    # ------------------------------------------------------------------
+
+    def in_business_hours(self, now=None):
+        if not self.business_hours:
+            return True
+        now = now or datetime.now()
+        if now.isoweekday() not in self.business_days:
+            return False
+        start, end = self.business_hours
+        current = dtime(now.hour, now.minute)
+        if start <= end:
+            return start <= current < end
+        # Fascia a cavallo della mezzanotte
+        return current >= start or current < end
+
+    def interval(self, now=None):
+        """Intervallo effettivo in secondi."""
+        with self._lock:
+            value = self.base_interval
+            if self.enabled:
+                value *= self._idle_factor
+                if not self.in_business_hours(now):
+                    value *= OFF_HOURS_FACTOR
+                if self._errors:
+                    value = max(value, self.base_interval) * 2 ** min(self._errors, MAX_ERROR_EXPONENT)
+                if self._rate_limited:
+                    value = max(value, self.base_interval * RATE_LIMIT_FACTOR)
+            value *= self._extra_factor
+
+        return int(min(max(value, self.min_interval), self.max_interval))
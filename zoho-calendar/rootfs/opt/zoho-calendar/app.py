@@ -9,13 +9,18 @@ Fornisce:
 - Thread scheduler per polling periodico e aggiornamento MQTT
 """
 
+import json
 import logging
 import os
 import sys
 import threading
+import time
+from datetime import date, datetime, timedelta
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
 
+import metrics
+from adaptive_poller import parse_business_hours
 from calendar_manager import CalendarManager
 from config_manager import ConfigManager
 from zoho_api import ZohoAPI, ZohoAPIError
@@ -33,6 +38,16 @@ app = Flask(__name__)
 # Ingress base path
 INGRESS_ENTRY = os.environ.get("INGRESS_ENTRY", "")
 
+# Intervallo keep-alive dello stream SSE (secondi)
+STREAM_KEEPALIVE = int(os.environ.get("STREAM_KEEPALIVE", "25"))
+
+# Server HTTP: "waitress" (produzione) o "flask" (sviluppo)
+SERVER_MODE = os.environ.get("SERVER_MODE", "waitress")
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "8"))
+SERVER_CONNECTION_LIMIT = int(os.environ.get("SERVER_CONNECTION_LIMIT", "100"))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "64"))
+SERVER_TIMEOUT = int(os.environ.get("SERVER_TIMEOUT", "120"))
+
 # Config manager (singleton)
 config_mgr = ConfigManager()
 
@@ -40,6 +55,26 @@ config_mgr = ConfigManager()
 manager = CalendarManager()
 
 
+# ======================================================================
+# Metriche richieste HTTP
+# ======================================================================
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, route=route, method=request.method,
+        )
+    return response
+
+
 # ======================================================================
 # Ingress: dashboard HTML
 # ======================================================================
@@ -56,10 +91,20 @@ def index():
 @app.route("/api/config/status")
 def api_config_status():
     """Restituisce se l'add-on e' configurato o no."""
-    return jsonify({
+    return jsonify(_config_status())
+
+
+def _config_status():
+    return {
         "configured": config_mgr.is_configured(),
-        "update_interval": int(os.environ.get("UPDATE_INTERVAL", "60")),
-    })
+        # Intervallo effettivo (polling adattivo), seguito dall'integrazione HA
+        "update_interval": manager.effective_interval,
+        "base_update_interval": manager.update_interval,
+        # Budget API basso: letture dalla cache e sync diradate
+        "degraded": manager.zoho.budget.is_low(),
+        # Chiamate Zoho residue oggi (None senza quota configurata)
+        "budget_remaining": manager.zoho.budget.remaining(),
+    }
 
 
 @app.route("/api/config")
@@ -163,8 +208,11 @@ def api_events_today():
     """Lista eventi di oggi."""
     if not config_mgr.is_configured():
         return jsonify({"data": [], "last_sync": None, "configured": False})
-    events = manager.get_events()
-    return jsonify({"data": events, "last_sync": manager.last_sync})
+    payload, age = manager.events_payload()
+    resp = _payload_response(payload)
+    if age is not None:
+        resp.headers["X-Data-Age"] = str(int(age))
+    return resp
 
 
 @app.route("/api/events/<date_str>")
@@ -172,62 +220,373 @@ def api_events_by_date(date_str):
     """Eventi per una data specifica (YYYY-MM-DD)."""
     if not config_mgr.is_configured():
         return jsonify({"data": [], "configured": False})
-    events = manager.get_events(date_str)
-    return jsonify({"data": events})
+    events, age = manager.get_events_with_age(date_str)
+    return _events_response(events, age)
+
+
+def _events_response(events, age, **extra):
+    """Risposta eventi con eta' dei dati (campo `age` e header X-Data-Age)."""
+    age = int(age) if age is not None else None
+    resp = jsonify({
+        "data": events,
+        "age": age,
+        "stale": age is not None and age >= manager.cache.ttl,
+        **extra,
+    })
+    if age is not None:
+        resp.headers["X-Data-Age"] = str(age)
+    return resp
 
 
 @app.route("/api/events", methods=["POST"])
 def api_create_event():
-    """Crea un nuovo evento."""
+    """Accoda la creazione di un nuovo evento."""
     body = request.get_json(force=True)
     required = ["titolo", "tecnico_id", "data", "ora_inizio", "ora_fine"]
     missing = [f for f in required if f not in body]
     if missing:
         return jsonify({"error": f"Campi mancanti: {', '.join(missing)}"}), 400
 
+    force = bool(body.get("force"))
     try:
-        result = manager.create_event(
-            titolo=body["titolo"],
-            tecnico_id=body["tecnico_id"],
-            data_str=body["data"],
-            ora_inizio=body["ora_inizio"],
-            ora_fine=body["ora_fine"],
-            descrizione=body.get("descrizione", ""),
+        conflicts = manager.find_conflicts(
+            body["tecnico_id"], body["data"], body["ora_inizio"], body["ora_fine"],
         )
-        return jsonify({"ok": True, "result": result})
-    except Exception as e:
-        logger.exception("Errore creazione evento")
-        return jsonify({"error": str(e)}), 500
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    unchecked = conflicts is None
+    conflicts = conflicts or []
+    if conflicts and not force:
+        return _conflicts_response(conflicts)
+
+    job = manager.submit_write("create", {
+        "titolo": body["titolo"],
+        "tecnico_id": body["tecnico_id"],
+        "data_str": body["data"],
+        "ora_inizio": body["ora_inizio"],
+        "ora_fine": body["ora_fine"],
+        "descrizione": body.get("descrizione", ""),
+    })
+    return _job_accepted(job, [ev.to_api() for ev in conflicts], unchecked)
+
+
+@app.route("/api/events/bulk", methods=["POST"])
+def api_create_events_bulk():
+    """Accoda la creazione di piu' eventi (es. ferie o reperibilita' del team)."""
+    body = request.get_json(force=True)
+    items = body.get("events") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Lista 'events' mancante o vuota"}), 400
+
+    required = ["titolo", "tecnico_id", "data", "ora_inizio", "ora_fine"]
+    force = bool(body.get("force"))
+    events = []
+    conflicts = {}
+    unchecked = []
+    for i, item in enumerate(items):
+        missing = [f for f in required if f not in item]
+        if missing:
+            return jsonify({
+                "error": f"Evento {i}: campi mancanti: {', '.join(missing)}",
+            }), 400
+        try:
+            found = manager.find_conflicts(
+                item["tecnico_id"], item["data"], item["ora_inizio"], item["ora_fine"],
+            )
+        except ValueError as e:
+            return jsonify({"error": f"Evento {i}: {e}"}), 400
+        if found is None:
+            unchecked.append(i)
+        elif found:
+            conflicts[i] = {"index": i, "conflicts": [ev.to_api() for ev in found]}
+        events.append({
+            "titolo": item["titolo"],
+            "tecnico_id": item["tecnico_id"],
+            "data_str": item["data"],
+            "ora_inizio": item["ora_inizio"],
+            "ora_fine": item["ora_fine"],
+            "descrizione": item.get("descrizione", ""),
+        })
+
+    # Eventi dello stesso invio che si sovrappongono tra loro
+    for i, others in manager.find_batch_conflicts(items).items():
+        conflicts.setdefault(i, {"index": i, "conflicts": []})["batch"] = others
+    conflicts = [conflicts[i] for i in sorted(conflicts)]
+
+    if conflicts and not force:
+        return jsonify({
+            "error": "Sovrapposizione con altri eventi dei tecnici",
+            "conflicts": conflicts,
+        }), 409
+
+    job = manager.submit_write("bulk_create", {"events": events})
+    return _job_accepted(job, conflicts, unchecked)
 
 
 @app.route("/api/events/<record_id>", methods=["PUT"])
 def api_update_event(record_id):
-    """Aggiorna un evento esistente."""
+    """Accoda l'aggiornamento di un evento esistente."""
     body = request.get_json(force=True)
+    force = bool(body.pop("force", False))
     try:
-        result = manager.update_event(record_id, body)
-        return jsonify({"ok": True, "result": result})
-    except Exception as e:
-        logger.exception("Errore aggiornamento evento")
-        return jsonify({"error": str(e)}), 500
+        conflicts = manager.find_update_conflicts(record_id, body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    unchecked = conflicts is None
+    conflicts = conflicts or []
+    if conflicts and not force:
+        return _conflicts_response(conflicts)
+
+    job = manager.submit_write("update", body, record_id=record_id)
+    return _job_accepted(job, [ev.to_api() for ev in conflicts], unchecked)
 
 
 @app.route("/api/events/<record_id>", methods=["DELETE"])
 def api_delete_event(record_id):
-    """Elimina un evento."""
+    """Accoda l'eliminazione di un evento."""
+    job = manager.submit_write("delete", record_id=record_id)
+    return _job_accepted(job)
+
+
+@app.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    """Stato di una scrittura accodata (queued, running, done, error)."""
+    job = manager.writes.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job non trovato"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/events/conflicts")
+def api_event_conflicts():
+    """Verifica sovrapposizioni prima di salvare (validazione durante la digitazione).
+
+    Query: tecnico_id, data (YYYY-MM-DD), ora_inizio, ora_fine (HH:MM),
+    exclude (ID dell'evento in modifica, opzionale).
+    """
+    args = request.args
     try:
-        result = manager.delete_event(record_id)
-        return jsonify({"ok": True, "result": result})
-    except Exception as e:
-        logger.exception("Errore eliminazione evento")
-        return jsonify({"error": str(e)}), 500
+        conflicts = manager.find_conflicts(
+            args.get("tecnico_id", ""), args.get("data", ""),
+            args.get("ora_inizio", ""), args.get("ora_fine", ""),
+            exclude_id=args.get("exclude"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "ok": not conflicts,
+        # False: giorno non ancora letto, nessuna verifica possibile
+        "checked": conflicts is not None,
+        "conflicts": [ev.to_api() for ev in conflicts or []],
+    })
+
+
+def _conflicts_response(conflicts):
+    return jsonify({
+        "error": "Sovrapposizione con altri eventi del tecnico",
+        "conflicts": [ev.to_api() for ev in conflicts],
+    }), 409
+
+
+def _job_accepted(job, conflicts=None, unchecked=None):
+    body = {"ok": True, "job_id": job["id"], "status": job["status"]}
+    if conflicts:
+        # Scrittura forzata: i conflitti vengono segnalati ma non bloccano
+        body["conflicts"] = conflicts
+    if unchecked:
+        # Giorni mai letti: sovrapposizioni non verificate (True o indici bulk)
+        body["unchecked"] = unchecked
+    resp = jsonify(body)
+    resp.status_code = 202
+    resp.headers["Location"] = f"{INGRESS_ENTRY}/api/jobs/{job['id']}"
+    return resp
 
 
 @app.route("/api/technicians")
 def api_technicians():
     """Lista tecnici con stato corrente."""
-    techs = manager.get_technicians_status()
-    return jsonify({"data": techs})
+    return _payload_response(manager.technicians_payload())
+
+
+def _payload_response(payload):
+    """Risposta da un payload pre-serializzato: gzip se accettato, 304 se l'ETag coincide.
+
+    Le varianti JSON e gzip hanno ETag distinti (suffisso "-gz").
+    """
+    gzipped = payload.gzipped is not None and request.accept_encodings["gzip"]
+    etag = payload.etag_gzip if gzipped else payload.etag
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    elif gzipped:
+        resp = Response(payload.gzipped, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(payload.body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+@app.route("/api/technicians/free")
+def api_technicians_free():
+    """Tecnici liberi in un intervallo (?from=...&to=..., data/ora ISO 8601)."""
+    if not config_mgr.is_configured():
+        return jsonify({"free": [], "busy": [], "configured": False})
+    try:
+        start = _datetime_arg("from")
+        end = _datetime_arg("to")
+        free, busy = manager.free_technicians(start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ZohoAPIError as e:
+        logger.error("Errore ricerca tecnici liberi: %s", e)
+        return jsonify({"error": str(e)}), 502
+    return jsonify({
+        "from": start.isoformat(timespec="minutes"),
+        "to": end.isoformat(timespec="minutes"),
+        "free": free,
+        "busy": busy,
+    })
+
+
+@app.route("/api/technicians/<tecnico_id>/events")
+def api_technician_events(tecnico_id):
+    """Storico eventi di un tecnico (ID o nome) dall'archivio locale.
+
+    Query: from / to (YYYY-MM-DD, default oggi).
+    """
+    try:
+        start = _date_arg("from")
+        end = _date_arg("to", default=start)
+        result = manager.technician_events(tecnico_id, start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "Tecnico non trovato"}), 404
+    tech, events = result
+    return jsonify({
+        "technician_id": tech.get("id", ""),
+        "technician": tech["name"],
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "count": len(events),
+        "events": events,
+    })
+
+
+@app.route("/api/availability")
+def api_availability():
+    """Slot liberi per durata richiesta.
+
+    Query: from / to (YYYY-MM-DD, default oggi), duration (minuti),
+    technicians (ID o nomi separati da virgola, opzionale), hours
+    (HH:MM-HH:MM, default orario lavorativo), limit (default 50).
+    """
+    if not config_mgr.is_configured():
+        return jsonify({"slots": [], "configured": False})
+    try:
+        start = _date_arg("from")
+        end = _date_arg("to", default=start)
+        duration = _int_arg("duration")
+        limit = _int_arg("limit", 50)
+        if limit < 1:
+            raise ValueError("Parametro 'limit' non valido (minimo 1)")
+        technicians = [t.strip() for t in request.args.get("technicians", "").split(",") if t.strip()]
+        hours = None
+        if request.args.get("hours"):
+            hours = parse_business_hours(request.args["hours"])
+            if not hours:
+                raise ValueError("Parametro 'hours' non valido (atteso HH:MM-HH:MM)")
+        slots = manager.availability(
+            start, end, timedelta(minutes=duration),
+            technicians=technicians, hours=hours, limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ZohoAPIError as e:
+        logger.error("Errore ricerca disponibilita': %s", e)
+        return jsonify({"error": str(e)}), 502
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "duration": duration,
+        "slots": slots,
+    })
+
+
+def _int_arg(name, default=None):
+    value = request.args.get(name, "")
+    if not value and default is not None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Parametro '{name}' mancante o non valido (atteso un intero)")
+
+
+def _date_arg(name, default=None):
+    """Parametro di query data (YYYY-MM-DD); senza valore `default` o oggi."""
+    value = request.args.get(name, "")
+    if not value:
+        return default or date.today()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Parametro '{name}' non valido (atteso YYYY-MM-DD)")
+
+
+def _datetime_arg(name):
+    """Parametro di query data/ora ISO 8601 (es. 2024-05-20T14:00)."""
+    value = request.args.get(name, "")
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        raise ValueError(f"Parametro '{name}' mancante o non valido (atteso YYYY-MM-DDTHH:MM)")
+
+
+@app.route("/api/snapshot")
+def api_snapshot():
+    """Stato, tecnici ed eventi di oggi in una sola risposta (per l'integrazione HA).
+
+    L'ETag dipende solo dai dati (tecnici, eventi, configurazione): con
+    If-None-Match invariato restituisce 304 senza corpo, anche se nel
+    frattempo sono cambiati solo ultimo sync, intervallo o budget.
+    """
+    configured = config_mgr.is_configured()
+    etag = manager.snapshot_etag(configured)
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify({
+            "status": _config_status(),
+            "technicians": manager.get_technicians_status(),
+            "events": manager.get_events() if configured else [],
+            "last_sync": manager.last_sync,
+        })
+    resp.set_etag(etag)
+    return resp
+
+
+@app.route("/api/stream")
+def api_stream():
+    """Stream Server-Sent Events: un evento `change` a ogni modifica dei dati."""
+    def _generate():
+        version = manager.changes.version
+        yield "retry: 5000\n"
+        yield f"event: hello\ndata: {json.dumps({'version': version})}\n\n"
+        while True:
+            change = manager.changes.wait(version, timeout=STREAM_KEEPALIVE)
+            if change is None:
+                yield ": keepalive\n\n"
+                continue
+            version = change["version"]
+            yield f"event: change\ndata: {json.dumps(change)}\n\n"
+
+    return Response(
+        stream_with_context(_generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/sync", methods=["POST"])
@@ -235,7 +594,7 @@ def api_sync():
     """Forza sincronizzazione manuale."""
     if not config_mgr.is_configured():
         return jsonify({"error": "Add-on non configurato"}), 400
-    manager.sync_calendar()
+    manager.sync_calendar(full=True)
     return jsonify({"ok": True, "last_sync": manager.last_sync})
 
 
@@ -246,9 +605,16 @@ def api_health():
         "status": "ok",
         "configured": config_mgr.is_configured(),
         "last_sync": manager.last_sync,
+        "budget": manager.zoho.budget.status(),
     })
 
 
+@app.route("/api/metrics")
+def api_metrics():
+    """Metriche in formato testo Prometheus."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 # ======================================================================
 # Startup
 # ======================================================================
@@ -260,9 +626,39 @@ def main():
     bg = threading.Thread(target=manager.start, daemon=True, name="calendar-mgr")
     bg.start()
 
+    if SERVER_MODE == "waitress":
+        try:
+            serve_waitress(port)
+            return
+        except ImportError:
+            logger.warning("waitress non installato, uso il server di sviluppo Flask")
+
     logger.info("Avvio server Flask su porta %d", port)
     app.run(host="0.0.0.0", port=port, debug=False)
 
 
+def serve_waitress(port):
+    """Server di produzione: pool di thread, keep-alive HTTP/1.1, timeout e coda limitata."""
+    from waitress import serve
+
+    logger.info(
+        "Avvio server waitress su porta %d (%d thread, max %d connessioni, backlog %d, timeout %ds)",
+        port, SERVER_THREADS, SERVER_CONNECTION_LIMIT, SERVER_BACKLOG, SERVER_TIMEOUT,
+    )
+    serve(
+        app,
+        host="0.0.0.0",
+        port=port,
+        threads=SERVER_THREADS,
+        connection_limit=SERVER_CONNECTION_LIMIT,
+        backlog=SERVER_BACKLOG,
+        # Chiude le connessioni inattive (keep-alive comprese)
+        channel_timeout=SERVER_TIMEOUT,
+        # poll() invece di select(): nessun limite di 1024 descrittori
+        asyncore_use_poll=True,
+        ident="zoho-calendar",
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+"""
+Boundary Scheduler
+
+Heap di timer sugli istanti di inizio/fine degli eventi: allo scadere di
+ogni confine richiama il callback con le chiavi interessate (es. i tecnici
+da ripubblicare), senza attendere il prossimo polling.
+"""
+
+import heapq
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Attesa massima tra due controlli (protegge da cambi dell'orologio di sistema)
+MAX_WAIT = 60
+
+
+class BoundaryScheduler:
+    def __init__(self, callback):
+        """`callback(keys)` riceve l'insieme delle chiavi dei confini scaduti."""
+        self._callback = callback
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="boundary-timer"
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def rebuild(self, boundaries):
+        """Sostituisce i timer con `boundaries` (iterabile di (datetime, chiave))."""
+        now = datetime.now()
+        heap = [(when, key) for when, key in boundaries if when > now]
+        heapq.heapify(heap)
+        with self._cond:
+            self._heap = heap
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if not self._heap:
+                    self._cond.wait(MAX_WAIT)
+                    continue
+                delay = (self._heap[0][0] - datetime.now()).total_seconds()
+                if delay > 0:
+                    self._cond.wait(min(delay, MAX_WAIT))
+                    continue
+                now = datetime.now()
+                due = set()
+                while self._heap and self._heap[0][0] <= now:
+                    due.add(heapq.heappop(self._heap)[1])
+
+            try:
+                self._callback(due)
+            except Exception as e:
+                logger.exception("Errore aggiornamento a confine evento: %s", e)
@@ -5,23 +5,48 @@ Orchestrazione tra Zoho API e MQTT Manager.
 Gestisce il polling periodico e le operazioni sul calendario.
 """
 
+import hashlib
+import heapq
 import logging
 import os
 import threading
 import time
-from datetime import date, datetime
+from datetime import date, datetime, time as dtime, timedelta
+from operator import attrgetter
 
 import schedule
 
+import metrics
+from adaptive_poller import AdaptivePoller, parse_business_days, parse_business_hours
+from boundary_scheduler import BoundaryScheduler
+from change_notifier import ChangeNotifier
 from config_manager import ConfigManager
+from event_cache import EventCache
+from event_model import Event, parse_datetime
+from event_store import EventStore
+from interval_index import IntervalIndex, free_slots
 from zoho_api import ZohoAPI, ZohoAPIError
 from mqtt_manager import MQTTManager
+from response_cache import ResponseCache
+from write_queue import WriteQueue
 
 logger = logging.getLogger(__name__)
 
 # Utenti esclusi dal calendario
 EXCLUDED_USERS = ["Nicola Grassi", "Francesco Brunelli"]
 
+# Moltiplicatore dell'intervallo di polling con budget API basso
+BUDGET_LOW_FACTOR = 4
+
+# Ampiezza massima delle ricerche di disponibilita' (giorni)
+MAX_QUERY_DAYS = 31
+
+# Ampiezza massima dello storico per tecnico (giorni)
+MAX_HISTORY_DAYS = 366
+
+# Margine sul timestamp del delta sync (clock skew / latenza di scrittura Zoho)
+DELTA_OVERLAP = timedelta(seconds=60)
+
 
 class CalendarManager:
     def __init__(self):
@@ -37,35 +62,124 @@ class CalendarManager:
         self.mqtt = MQTTManager(technicians=self.technicians)
         self.update_interval = int(os.environ.get("UPDATE_INTERVAL", "60"))
 
+        # Polling adattivo: update_interval e' l'intervallo base
+        self.poller = AdaptivePoller(
+            base_interval=self.update_interval,
+            min_interval=int(os.environ.get("POLL_MIN_INTERVAL", "30")),
+            max_interval=int(os.environ.get("POLL_MAX_INTERVAL", "900")),
+            business_hours=parse_business_hours(os.environ.get("BUSINESS_HOURS", "07:00-19:00")),
+            business_days=parse_business_days(os.environ.get("BUSINESS_DAYS", "1,2,3,4,5")),
+            enabled=os.environ.get("ADAPTIVE_POLLING", "true").lower() == "true",
+        )
+        self._sync_job = None
+
         # Cache eventi correnti
         self._events = []
         self._events_by_tech = {}
+        self._index = IntervalIndex()
         self._last_sync = None
         self._scheduler_thread = None
         self._running = False
 
+        # Archivio persistente su /config (avvio a caldo, storico senza API)
+        self.store = EventStore(
+            retention_days=int(os.environ.get("EVENT_STORE_RETENTION_DAYS", "365")),
+        )
+
+        # Cache multi-giorno (finestra mobile attorno ad oggi)
+        self.cache = EventCache(
+            days_back=int(os.environ.get("CACHE_DAYS_BACK", "7")),
+            days_forward=int(os.environ.get("CACHE_DAYS_FORWARD", "30")),
+            ttl=int(os.environ.get("CACHE_TTL", "900")),
+            max_days=int(os.environ.get("CACHE_MAX_DAYS", "60")),
+            store=self.store,
+        )
+        self.prefetch_interval = int(os.environ.get("CACHE_PREFETCH_INTERVAL", "300"))
+
+        # Date scadute in aggiornamento in background (stale-while-revalidate)
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+
+        # Delta sync: tra due sync complete si leggono solo i record modificati.
+        # 0 disabilita il delta (ogni sync e' completa).
+        self.full_resync_interval = int(os.environ.get("FULL_RESYNC_INTERVAL", "900"))
+        self._last_full_sync_at = 0
+        # Dopo un delta fallito (es. formato Modified_Time rifiutato) solo sync complete
+        self._delta_retry_at = 0
+        self._last_sync_started = None
+        self._synced_date = None
+
+        # Scritture: applicate subito in locale, riconciliate in background
+        self.reconcile_delay = int(os.environ.get("RECONCILE_DELAY", "15"))
+        self._events_lock = threading.RLock()
+        self._reconcile_timer = None
+        self._reconcile_full = False
+
+        # Coda scritture asincrone (job ID consultabili via API)
+        self.writes = WriteQueue(self._execute_write)
+
+        # Versione dei dati, notificata allo stream /api/stream
+        self.changes = ChangeNotifier()
+
+        # Risposte /api/events e /api/technicians pre-serializzate per versione
+        self.payloads = ResponseCache()
+
+        # Timer su inizio/fine eventi: stato aggiornato al secondo
+        self.boundaries = BoundaryScheduler(self._on_boundary)
+
     # ------------------------------------------------------------------
     # Lifecycle
     # ------------------------------------------------------------------
 
     def start(self):
         """Avvia il manager: connette MQTT e avvia lo scheduler."""
+        self.boundaries.start()
         if not self.config_manager.is_configured():
             logger.warning("Add-on non configurato, in attesa di configurazione dalla web UI...")
             # Avvia comunque lo scheduler che controllera' periodicamente
             self._start_scheduler()
             return
 
+        warm = self._warm_start()
         self.mqtt.connect()
+        if warm:
+            # Sensori subito aggiornati anche se Zoho non e' raggiungibile
+            for tech in self.technicians:
+                self._publish_technician(tech["name"])
+            self.mqtt.update_general(len(self._events), self._last_sync)
         self.sync_calendar()
+        self.prefetch_window()
         self._start_scheduler()
 
     def stop(self):
         """Ferma lo scheduler e disconnette MQTT."""
         self._running = False
         schedule.clear()
+        self.boundaries.stop()
         self.mqtt.disconnect()
 
+    def _warm_start(self):
+        """Carica dall'archivio locale gli eventi di oggi e la finestra in cache.
+
+        Restituisce True se erano presenti dati di oggi.
+        """
+        self.store.prune()
+        days = self.cache.load_window()
+        entry = self.store.get_day(date.today().isoformat())
+        if entry is None:
+            logger.info("Avvio a freddo: nessun dato di oggi nell'archivio (%d giorni)", days)
+            return False
+
+        events, fetched_at = entry
+        with self._events_lock:
+            self._set_today_events(self._filter_events(events), fetched_at)
+        self._last_sync = datetime.fromtimestamp(fetched_at).strftime("%Y-%m-%d %H:%M:%S")
+        logger.info(
+            "Avvio a caldo: %d eventi di oggi, %d giorni dall'archivio (sync del %s)",
+            len(self._events), days, self._last_sync,
+        )
+        return True
+
     def reconfigure(self):
         """Ricarica la configurazione e riapplica senza riavvio."""
         self.config_manager.load()
@@ -79,13 +193,17 @@ class CalendarManager:
         self.mqtt.technicians = self.technicians
         self.mqtt.refresh_discovery()
 
+        # Il filtro tecnici puo' essere cambiato: svuota la cache
+        self.cache.clear()
+        self.changes.notify("config")
+
         # Connetti MQTT se non gia' connesso
         if not self.mqtt._connected:
             self.mqtt.connect()
 
         # Forza sync
         if self.config_manager.is_configured():
-            self.sync_calendar()
+            self.sync_calendar(full=True)
 
         logger.info("CalendarManager riconfigurato")
 
@@ -93,7 +211,8 @@ class CalendarManager:
         """Avvia il thread scheduler per il polling periodico."""
         self._running = True
 
-        schedule.every(self.update_interval).seconds.do(self._scheduled_sync)
+        self._sync_job = schedule.every(self.effective_interval).seconds.do(self._scheduled_sync)
+        schedule.every(self.prefetch_interval).seconds.do(self._scheduled_prefetch)
 
         def _run():
             while self._running:
@@ -105,56 +224,228 @@ class CalendarManager:
         )
         self._scheduler_thread.start()
         logger.info(
-            "Scheduler avviato (intervallo: %ds)", self.update_interval
+            "Scheduler avviato (intervallo: %ds)", self.effective_interval
         )
 
     def _scheduled_sync(self):
-        """Sync schedulata: esegue solo se configurato."""
-        if self.config_manager.is_configured():
+        """Sync schedulata: esegue solo se configurato e con budget API disponibile."""
+        budget = self.zoho.budget
+        if budget.reads_exhausted():
+            logger.warning("Budget API esaurito: sync saltata, dati serviti dalla cache")
+        elif self.config_manager.is_configured():
             self.sync_calendar()
+        self.poller.set_extra_factor(BUDGET_LOW_FACTOR if budget.is_low() else 1)
+        self._reschedule()
+
+    @property
+    def effective_interval(self):
+        """Intervallo di polling attualmente in uso (secondi)."""
+        return self.poller.interval()
+
+    def _reschedule(self):
+        """Aggiorna l'intervallo del job: vale dal prossimo run."""
+        interval = self.effective_interval
+        if self._sync_job and self._sync_job.interval != interval:
+            logger.info(
+                "Intervallo polling: %ds -> %ds", self._sync_job.interval, interval
+            )
+            self._sync_job.interval = interval
+
+    def _scheduled_prefetch(self):
+        """Prefetch schedulato della finestra: esegue solo se configurato."""
+        if not self.config_manager.is_configured():
+            return
+        if self.zoho.budget.is_low():
+            logger.info("Budget API basso: prefetch finestra sospeso")
+            return
+        self.prefetch_window()
 
     # ------------------------------------------------------------------
     # Sync
     # ------------------------------------------------------------------
 
-    def sync_calendar(self):
-        """Polling: legge eventi da Zoho e aggiorna sensori MQTT."""
+    def sync_calendar(self, full=False):
+        """Polling: legge eventi da Zoho e aggiorna sensori MQTT.
+
+        Se possibile esegue un delta sync (solo record modificati dall'ultima
+        sync); una sync completa periodica intercetta le eliminazioni.
+        """
         if not self.config_manager.is_configured():
             logger.debug("Skip sync: non configurato")
             return
 
-        logger.info("Sincronizzazione calendario...")
-        try:
-            raw_events = self.zoho.get_today_events()
+        started = datetime.now()
+        today = date.today().isoformat()
+        full = full or self._needs_full_sync(today)
 
-            events = self._filter_events(raw_events)
+        mode = "full" if full else "delta"
+        phase = metrics.SYNC_PHASE_SECONDS.time
+        sync_start = time.perf_counter()
 
-            self._events = events
-            self._last_sync = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        logger.info("Sincronizzazione calendario (%s)...", "completa" if full else "delta")
+        fallback = False
+        with self.zoho.call_category("sync"):
+            try:
+                with phase(phase="token", mode=mode):
+                    self.zoho.get_access_token()
 
-            # Raggruppa per tecnico
-            self._events_by_tech = {}
-            for ev in events:
-                tech_name = ev.get("LkpTecnico", {}).get("Nominativo", "Sconosciuto")
-                self._events_by_tech.setdefault(tech_name, []).append(ev)
+                if full:
+                    with phase(phase="fetch", mode=mode):
+                        raw_events = self.zoho.get_today_events()
+                    with self._events_lock:
+                        with phase(phase="filter", mode=mode):
+                            events = self._ingest(raw_events)
+                        with phase(phase="group", mode=mode):
+                            changed = self._set_today_events(events)
+                    self._last_full_sync_at = time.time()
+                    self._synced_date = today
+                else:
+                    with phase(phase="fetch", mode=mode):
+                        changed = self._fetch_delta(self._last_sync_started - DELTA_OVERLAP)
+                    with self._events_lock:
+                        with phase(phase="filter", mode=mode):
+                            events = self._merge_delta(changed, today)
+                        with phase(phase="group", mode=mode):
+                            changed = self._set_today_events(events)
+                self._last_sync_started = started
+                self._last_sync = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            # Aggiorna sensori MQTT per ogni tecnico configurato
-            for tech in self.technicians:
-                name = tech["name"]
-                tech_events = self._events_by_tech.get(name, [])
-                self.mqtt.update_technician(name, tech_events)
+                with phase(phase="publish", mode=mode):
+                    # Aggiorna sensori MQTT per ogni tecnico configurato
+                    for tech in self.technicians:
+                        self._publish_technician(tech["name"])
 
-            # Sensori generali
-            self.mqtt.update_general(len(events), self._last_sync)
+                    # Sensori generali
+                    self.mqtt.update_general(len(events), self._last_sync)
 
-            logger.info(
-                "Sync completata: %d eventi, %d tecnici attivi",
-                len(events), len(self._events_by_tech),
-            )
+                metrics.SYNC_PHASE_SECONDS.observe(
+                    time.perf_counter() - sync_start, phase="total", mode=mode,
+                )
+                if changed:
+                    self.changes.notify("sync")
+                with phase(phase="serialize", mode=mode):
+                    self._prepare_payloads()
+                self.poller.record_success(changed)
+                logger.info(
+                    "Sync completata: %d eventi, %d tecnici attivi",
+                    len(events), len(self._events_by_tech),
+                )
+            except ZohoAPIError as e:
+                if not full and e.status_code != 429:
+                    logger.warning(
+                        "Delta sync fallito (%s): sync completa, delta sospeso per %ds",
+                        e, self.full_resync_interval,
+                    )
+                    self._delta_retry_at = time.time() + self.full_resync_interval
+                    fallback = True
+                else:
+                    logger.error("Errore sync Zoho: %s", e)
+                    self.poller.record_error(e.status_code)
+            except Exception as e:
+                logger.exception("Errore sync imprevisto: %s", e)
+                self.poller.record_error()
+
+        if fallback:
+            self.sync_calendar(full=True)
+
+    def _needs_full_sync(self, today):
+        if self.full_resync_interval <= 0 or self._last_sync_started is None:
+            return True
+        if self._synced_date != today or time.time() < self._delta_retry_at:
+            return True
+        return time.time() - self._last_full_sync_at >= self.full_resync_interval
+
+    def _fetch_delta(self, since):
+        """Legge da Zoho i record modificati da `since` (ID -> evento normalizzato)."""
+        changed = {}
+        for page in self.zoho.iter_modified_since(since):
+            for ev in map(Event.from_record, page):
+                changed[ev.id] = ev
+        return changed
+
+    def _merge_delta(self, changed, today):
+        """Fonde i record modificati nel set locale.
+
+        Restituisce il nuovo set di eventi di oggi; aggiorna anche i giorni
+        della cache multi-giorno toccati dal delta.
+        """
+        if not changed:
+            return self._events
+
+        by_date = {}
+        for ev in self._filter_events(changed.values()):
+            by_date.setdefault(ev.day, []).append(ev)
+
+        # Record spostati ad altra data o su tecnici esclusi spariscono da oggi
+        events = [ev for ev in self._events if ev.id not in changed]
+        events.extend(by_date.get(today, []))
+        self.cache.merge(changed.keys(), by_date)
+        logger.info("Delta sync: %d record modificati", len(changed))
+        return events
+
+    def _set_today_events(self, events, fetched_at=None):
+        """Sostituisce gli eventi di oggi e ricostruisce l'indice per tecnico.
+
+        Restituisce True se gli eventi sono cambiati.
+        """
+        changed = events != self._events
+        self._events = events
+        self.cache.put(date.today().isoformat(), events, fetched_at)
+
+        # Raggruppa per tecnico
+        by_tech = {}
+        for ev in events:
+            by_tech.setdefault(ev.technician, []).append(ev)
+        self._events_by_tech = by_tech
+        self._index = IntervalIndex(events)
+        self.boundaries.rebuild(self._event_boundaries(events))
+        return changed
+
+    def _event_boundaries(self, events):
+        """Istanti di inizio/fine degli eventi di oggi, per tecnico."""
+        for ev in events:
+            for when in (ev.start, ev.end):
+                if when is not None:
+                    yield when, ev.technician
+
+    def _on_boundary(self, names):
+        """Un evento e' iniziato o finito: ripubblica solo i tecnici coinvolti."""
+        configured = {t["name"] for t in self.technicians}
+        for name in names & configured:
+            self._publish_technician(name)
+        logger.debug("Confine evento: aggiornati %s", ", ".join(sorted(names)))
+        self.changes.notify("boundary")
+
+    def _publish_technician(self, name):
+        now = datetime.now()
+        self.mqtt.update_technician(
+            name,
+            self._events_by_tech.get(name, []),
+            current=self._index.active_at(name, now),
+            next_event=self._index.upcoming(name, now),
+        )
+
+    def prefetch_window(self):
+        """Carica in cache i giorni della finestra mancanti o scaduti."""
+        if not self.config_manager.is_configured():
+            return
+
+        stale = self.cache.stale_dates()
+        if not stale:
+            return
+
+        start, end = min(stale), max(stale)
+        logger.info(
+            "Prefetch cache eventi: %d giorni da aggiornare (%s - %s)",
+            len(stale), start, end,
+        )
+        try:
+            with self.zoho.call_category("prefetch"):
+                self._fetch_dates(stale)
         except ZohoAPIError as e:
-            logger.error("Errore sync Zoho: %s", e)
+            logger.error("Errore prefetch %s - %s: %s", start, end, e)
         except Exception as e:
-            logger.exception("Errore sync imprevisto: %s", e)
+            logger.exception("Errore prefetch imprevisto: %s", e)
 
     # ------------------------------------------------------------------
     # Read
@@ -162,16 +453,85 @@ class CalendarManager:
 
     def get_events(self, target_date=None):
         """Restituisce eventi per una data (default: oggi, dalla cache)."""
-        if target_date is None or target_date == date.today().isoformat():
-            return self._transform_events(self._events)
-        # Per date diverse, richiedi a Zoho
+        return self.get_events_with_age(target_date)[0]
+
+    def get_events_with_age(self, target_date=None):
+        """Eventi per una data e eta' dei dati in secondi (None se non disponibile).
+
+        Stale-while-revalidate: le date gia' lette (in memoria o nell'archivio
+        locale) rispondono subito; se scadute parte un aggiornamento in
+        background. Solo una data mai letta attende Zoho.
+        """
+        today = date.today().isoformat()
+        if target_date is None or target_date == today:
+            metrics.EVENTS_CACHE.inc(result="hit")
+            entry = self.cache.get_entry(today)
+            age = time.time() - entry[1] if entry else None
+            return self._transform_events(self._events), age
+
+        entry = self.cache.get_entry(target_date)
+        if entry is not None:
+            events, fetched_at = entry
+            if self.cache.is_fresh(fetched_at):
+                metrics.EVENTS_CACHE.inc(result="hit")
+            else:
+                metrics.EVENTS_CACHE.inc(result="stale")
+                self._refresh_in_background(target_date)
+            return self._transform_events(events), time.time() - fetched_at
+
+        # Cache miss: richiedi a Zoho e memorizza
+        metrics.EVENTS_CACHE.inc(result="miss")
         try:
-            raw = self.zoho.get_events_by_date(target_date)
-            filtered = self._filter_events(raw)
-            return self._transform_events(filtered)
+            return self._transform_events(self._fetch_date(target_date)), 0.0
         except ZohoAPIError as e:
             logger.error("Errore lettura eventi: %s", e)
-            return []
+            return [], None
+
+    def _fetch_date(self, target_date):
+        """Legge da Zoho gli eventi di una data e li memorizza in cache."""
+        filtered = self._ingest(self.zoho.get_events_by_date(target_date))
+        self.cache.put(target_date, filtered)
+        return filtered
+
+    def _fetch_dates(self, dates):
+        """Legge da Zoho piu' date con una sola query per range e le memorizza.
+
+        La query copre dalla prima all'ultima data ed e' accorpata a letture
+        identiche in corso; in cache finiscono solo le date richieste.
+        """
+        by_date = {d: [] for d in dates}
+        records = self.zoho.get_events_in_range(min(by_date), max(by_date))
+        for ev in self._ingest(records):
+            if ev.day in by_date:
+                by_date[ev.day].append(ev)
+        self.cache.put_many(by_date)
+        return by_date
+
+    def _refresh_in_background(self, target_date):
+        """Aggiorna una data scaduta senza bloccare la richiesta (uno per data)."""
+        if self.zoho.budget.is_low():
+            # Modalita' degradata: si servono i dati in cache cosi' come sono
+            return
+        with self._refresh_lock:
+            if target_date in self._refreshing:
+                return
+            self._refreshing.add(target_date)
+        threading.Thread(
+            target=self._background_refresh, args=(target_date,),
+            daemon=True, name=f"refresh-{target_date}",
+        ).start()
+
+    def _background_refresh(self, target_date):
+        try:
+            self._fetch_date(target_date)
+            logger.debug("Cache eventi %s aggiornata in background", target_date)
+        except ZohoAPIError as e:
+            logger.warning("Aggiornamento in background %s fallito: %s", target_date, e)
+        except Exception as e:
+            logger.exception("Errore aggiornamento in background %s: %s", target_date, e)
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(target_date)
 
     def get_technicians_status(self):
         """Restituisce lo stato di ogni tecnico configurato."""
@@ -179,7 +539,7 @@ class CalendarManager:
         for tech in self.technicians:
             name = tech["name"]
             events = self._events_by_tech.get(name, [])
-            status = self._get_technician_status(name, events)
+            status = self._get_technician_status(name)
             result.append({
                 "id": tech.get("id", ""),
                 "name": name,
@@ -188,6 +548,333 @@ class CalendarManager:
             })
         return result
 
+    # ------------------------------------------------------------------
+    # Payload pre-serializzati
+    # ------------------------------------------------------------------
+
+    def events_payload(self):
+        """Risposta di /api/events (eventi di oggi) ed eta' dei dati in secondi."""
+        metrics.EVENTS_CACHE.inc(result="hit")
+        entry = self.cache.get_entry(date.today().isoformat())
+        return self._today_payload(), (time.time() - entry[1] if entry else None)
+
+    def _today_payload(self):
+        return self.payloads.get("events", self._payload_stamp(), lambda: {
+            "data": self._transform_events(self._events),
+            "last_sync": self._last_sync,
+        })
+
+    def technicians_payload(self):
+        """Risposta di /api/technicians (tecnici con stato corrente)."""
+        return self.payloads.get(
+            "technicians", self._payload_stamp(),
+            lambda: {"data": self.get_technicians_status()},
+        )
+
+    def snapshot_etag(self, configured=True):
+        """ETag di /api/snapshot calcolato solo sui dati (tecnici, eventi di oggi, configurazione).
+
+        Ultimo sync, intervallo effettivo e budget cambiano a ogni sync anche
+        senza modifiche: restano fuori, cosi' l'integrazione riceve 304.
+        """
+        events = self.payloads.get(
+            "events_data", self._payload_stamp(),
+            lambda: self._transform_events(self._events),
+        ).etag if configured else ""
+        key = f"{self.technicians_payload().etag}:{events}:{configured}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _payload_stamp(self):
+        # Ogni modifica (sync, scrittura, confine evento, config) cambia la
+        # versione; last_sync copre le sync senza modifiche e l'avvio a caldo
+        return self.changes.version, self._last_sync
+
+    def _prepare_payloads(self):
+        """Serializza subito le risposte: le richieste successive trovano i byte pronti."""
+        self._today_payload()
+        self.technicians_payload()
+
+    def free_technicians(self, start, end):
+        """Tecnici configurati senza eventi tra `start` e `end` (datetime).
+
+        Interroga l'indice per tecnico dei giorni coinvolti, dalla cache; solo
+        i giorni mai letti vengono richiesti a Zoho, con una sola query per
+        range. Restituisce (liberi,
+        occupati): liste di {"id", "name"}, gli occupati anche con "status".
+        """
+        if end <= start:
+            raise ValueError("Intervallo non valido: 'to' deve essere successivo a 'from'")
+        if (end - start).days > MAX_QUERY_DAYS:
+            raise ValueError(f"Intervallo troppo ampio (massimo {MAX_QUERY_DAYS} giorni)")
+
+        # Dal giorno precedente, per gli eventi a cavallo della mezzanotte
+        first = start.date() - timedelta(days=1)
+        last = (end - timedelta(microseconds=1)).date()
+        indexes = self._day_indexes(
+            [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+        )
+        days = [(index, i > 0) for i, index in enumerate(indexes)]
+
+        free, busy = [], []
+        for tech in self.technicians:
+            name = tech["name"]
+            item = {"id": tech.get("id", ""), "name": name}
+            status = None
+            for index, in_range in days:
+                if in_range and index.absence(name):
+                    status = index.absence(name)
+                elif not index.is_free(name, start, end, absences=False):
+                    status = "occupato"
+                if status:
+                    break
+            if status:
+                busy.append(dict(item, status=status))
+            else:
+                free.append(item)
+        return free, busy
+
+    def availability(self, start_date, end_date, duration, technicians=None,
+                     hours=None, limit=50):
+        """Slot liberi di almeno `duration` (timedelta) tra due date incluse.
+
+        Per ogni giorno lavorativo e tecnico (tutti o il sottoinsieme
+        `technicians`, per ID o nome) una passata sugli eventi ordinati
+        dell'indice individua i buchi nell'orario `hours` (default: orario
+        lavorativo). Ferie e malattia bloccano il giorno. Gli slot sono
+        ordinati per inizio, poi per adattamento (slot piu' corto prima).
+        """
+        if end_date < start_date:
+            raise ValueError("Intervallo non valido: 'to' precede 'from'")
+        if (end_date - start_date).days > MAX_QUERY_DAYS:
+            raise ValueError(f"Intervallo troppo ampio (massimo {MAX_QUERY_DAYS} giorni)")
+        if duration <= timedelta(0):
+            raise ValueError("Durata non valida")
+
+        techs = self.technicians
+        if technicians:
+            wanted = {str(t) for t in technicians}
+            techs = [
+                t for t in techs
+                if str(t.get("id", "")) in wanted or t.get("name") in wanted
+            ]
+
+        hours = hours or self.poller.business_hours or (dtime(0), dtime(0))
+        now = datetime.now().replace(second=0, microsecond=0)
+        slots = []
+        # Dal giorno precedente, per gli eventi a cavallo della mezzanotte
+        indexes = self._day_indexes(
+            [(start_date + timedelta(days=i)).isoformat()
+             for i in range(-1, (end_date - start_date).days + 1)]
+        )
+        prev_index = indexes[0]
+        for i, index in enumerate(indexes[1:]):
+            day = start_date + timedelta(days=i)
+            window_start = datetime.combine(day, hours[0])
+            window_end = datetime.combine(day, hours[1])
+            if window_end <= window_start:
+                # Orario a cavallo della mezzanotte (o giornata intera)
+                window_end += timedelta(days=1)
+            window_start = max(window_start, now)
+            working = day.isoweekday() in self.poller.business_days
+            if working and window_end - window_start >= duration:
+                for tech in techs:
+                    name = tech["name"]
+                    if index.absence(name):
+                        continue
+                    # Eventi del giorno e code di quelli iniziati il giorno prima
+                    busy = heapq.merge(
+                        prev_index.overlapping(name, window_start, window_end),
+                        index.overlapping(name, window_start, window_end),
+                        key=attrgetter("start"),
+                    )
+                    for slot_start, slot_end in free_slots(busy, window_start, window_end, duration):
+                        slots.append((slot_start, slot_end - slot_start, name, tech.get("id", "")))
+            prev_index = index
+
+        slots.sort(key=lambda s: (s[0], s[1], s[2]))
+        return [
+            {
+                "technician_id": tech_id,
+                "technician": name,
+                "start": slot_start.isoformat(timespec="minutes"),
+                "end": (slot_start + length).isoformat(timespec="minutes"),
+                "minutes": int(length.total_seconds() // 60),
+            }
+            for slot_start, length, name, tech_id in slots[:limit]
+        ]
+
+    def technician_events(self, tecnico_id, start_date, end_date):
+        """Storico eventi di un tecnico (ID o nome) tra due date incluse.
+
+        Letto dall'archivio locale tramite l'indice (tecnico, data), senza
+        chiamate Zoho: copre le date gia' sincronizzate o lette. Restituisce
+        (tecnico, eventi) oppure None se il tecnico non e' configurato.
+        """
+        if end_date < start_date:
+            raise ValueError("Intervallo non valido: 'to' precede 'from'")
+        if (end_date - start_date).days > MAX_HISTORY_DAYS:
+            raise ValueError(f"Intervallo troppo ampio (massimo {MAX_HISTORY_DAYS} giorni)")
+        tech = next(
+            (t for t in self.technicians
+             if str(t.get("id", "")) == str(tecnico_id) or t.get("name") == tecnico_id),
+            None,
+        )
+        if tech is None:
+            return None
+        events = self.store.technician_events(
+            tech["name"], start_date.isoformat(), end_date.isoformat()
+        )
+        return tech, self._transform_events(events)
+
+    def find_conflicts(self, tecnico_id, data_str, ora_inizio, ora_fine, exclude_id=None):
+        """Eventi locali del tecnico che si sovrappongono all'intervallo proposto.
+
+        Controllo preventivo alle scritture: usa solo l'indice per tecnico dei
+        giorni in cache o nell'archivio locale, mai chiamate Zoho bloccanti.
+        Ferie o malattia nel giorno contano come conflitto. Restituisce None
+        (non verificato) se il giorno o il precedente non sono mai stati
+        letti, o se il tecnico non e' tra quelli configurati: la lettura parte
+        in background per i controlli successivi.
+        """
+        day, start, end = self._proposed_interval(data_str, ora_inizio, ora_fine)
+        name = self._technician_name(tecnico_id)
+        if not name:
+            return None
+
+        index = self._cached_day_index(day.isoformat())
+        prev_index = self._cached_day_index((day - timedelta(days=1)).isoformat())
+        if index is None or prev_index is None:
+            return None
+        candidates = [index.absence_event(name)] + list(heapq.merge(
+            prev_index.overlapping(name, start, end),
+            index.overlapping(name, start, end),
+            key=attrgetter("start"),
+        ))
+        conflicts = []
+        seen = {str(exclude_id)} if exclude_id else set()
+        for ev in candidates:
+            if ev is not None and ev.id not in seen:
+                seen.add(ev.id)
+                conflicts.append(ev)
+        return conflicts
+
+    def find_batch_conflicts(self, items):
+        """Sovrapposizioni tra gli eventi di uno stesso invio multiplo.
+
+        `items` sono dict con tecnico_id, data, ora_inizio, ora_fine (gia'
+        validati). Restituisce {indice: [indici degli altri eventi dello
+        stesso tecnico che si sovrappongono]}, solo per gli eventi in conflitto.
+        """
+        by_tech = {}
+        for i, item in enumerate(items):
+            name = self._technician_name(item["tecnico_id"])
+            if name:
+                _, start, end = self._proposed_interval(
+                    item["data"], item["ora_inizio"], item["ora_fine"],
+                )
+                by_tech.setdefault(name, []).append((start, end, i))
+
+        found = {}
+        for intervals in by_tech.values():
+            intervals.sort()
+            active = []
+            for start, end, i in intervals:
+                active = [a for a in active if a[0] > start]
+                for _, j in active:
+                    found.setdefault(i, []).append(j)
+                    found.setdefault(j, []).append(i)
+                active.append((end, i))
+        return {i: sorted(others) for i, others in found.items()}
+
+    @staticmethod
+    def _proposed_interval(data_str, ora_inizio, ora_fine):
+        """(giorno, inizio, fine) di un evento proposto; ValueError se non valido."""
+        try:
+            day = date.fromisoformat(data_str)
+        except (TypeError, ValueError):
+            raise ValueError(f"Data non valida: {data_str!r} (atteso YYYY-MM-DD)")
+        start = parse_datetime(ora_inizio, day)
+        end = parse_datetime(ora_fine, day)
+        if start is None or end is None:
+            raise ValueError("Orario non valido (atteso HH:MM)")
+        if end <= start:
+            raise ValueError("L'ora di fine deve essere successiva all'ora di inizio")
+        return day, start, end
+
+    def find_update_conflicts(self, record_id, fields):
+        """Conflitti dell'evento `record_id` dopo l'applicazione di `fields`.
+
+        Nessun controllo se i campi non toccano tecnico, data o orari, o se
+        l'evento non e' tra quelli locali. None se non verificabile (vedi
+        find_conflicts).
+        """
+        keys = ("tecnico_id", "data", "ora_inizio", "ora_fine")
+        if not any(k in fields for k in keys):
+            return []
+        current = self._find_record(record_id)
+        if current is None or current.start is None or current.end is None:
+            return None
+        return self.find_conflicts(
+            fields.get("tecnico_id") or current.technician_id,
+            fields.get("data") or current.day,
+            fields.get("ora_inizio") or current.start.strftime("%H:%M"),
+            fields.get("ora_fine") or current.end.strftime("%H:%M"),
+            exclude_id=record_id,
+        )
+
+    def _cached_day_index(self, date_str):
+        """Indice di una data dalla cache o dall'archivio, None se mai letta.
+
+        Non chiama Zoho: le date mancanti o scadute vengono lette in background.
+        """
+        if date_str == date.today().isoformat():
+            return self._index if self._last_sync else None
+        entry = self.cache.get_entry(date_str)
+        if entry is None:
+            metrics.EVENTS_CACHE.inc(result="miss")
+            self._refresh_in_background(date_str)
+            return None
+        if self.cache.is_fresh(entry[1]):
+            metrics.EVENTS_CACHE.inc(result="hit")
+        else:
+            metrics.EVENTS_CACHE.inc(result="stale")
+            self._refresh_in_background(date_str)
+        return self.cache.get_index(date_str)
+
+    def _day_indexes(self, dates):
+        """Indici per tecnico degli eventi di piu' date (stale-while-revalidate).
+
+        Le date scadute rispondono dalla cache con aggiornamento in background;
+        quelle mai lette vengono richieste a Zoho insieme, con una sola query
+        per range invece di una lettura bloccante per giorno.
+        """
+        today = date.today().isoformat()
+        missing = []
+        for date_str in dates:
+            if date_str == today:
+                continue
+            entry = self.cache.get_entry(date_str)
+            if entry is None:
+                metrics.EVENTS_CACHE.inc(result="miss")
+                missing.append(date_str)
+            elif not self.cache.is_fresh(entry[1]):
+                metrics.EVENTS_CACHE.inc(result="stale")
+                self._refresh_in_background(date_str)
+            else:
+                metrics.EVENTS_CACHE.inc(result="hit")
+        fetched = self._fetch_dates(missing) if missing else {}
+
+        indexes = []
+        for date_str in dates:
+            if date_str == today:
+                indexes.append(self._index)
+            elif date_str in fetched:
+                # Indipendente da un'eventuale eviction della cache
+                indexes.append(self.cache.get_index(date_str) or IntervalIndex(fetched[date_str]))
+            else:
+                indexes.append(self.cache.get_index(date_str) or IntervalIndex())
+        return indexes
+
     @property
     def last_sync(self):
         return self._last_sync
@@ -196,94 +883,254 @@ class CalendarManager:
     # Write
     # ------------------------------------------------------------------
 
+    def submit_write(self, action, payload=None, record_id=None):
+        """Accoda una scrittura (create/update/delete) e restituisce il job."""
+        return self.writes.submit(action, payload, record_id)
+
+    def _execute_write(self, action, record_id, payload):
+        if action == "create":
+            return self.create_event(**payload)
+        if action == "update":
+            return self.update_event(record_id, payload)
+        if action == "delete":
+            return self.delete_event(record_id)
+        if action == "bulk_create":
+            return self.create_events(payload["events"])
+        raise ValueError(f"Operazione sconosciuta: {action}")
+
     def create_event(self, titolo, tecnico_id, data_str, ora_inizio,
                      ora_fine, descrizione=""):
         """Crea un nuovo evento su Zoho Creator."""
-        defaults = self.config_manager.get_event_defaults()
+        event_data = self._build_event_data(
+            titolo, tecnico_id, data_str, ora_inizio, ora_fine, descrizione,
+        )
+        result = self.zoho.create_event(event_data)
 
-        tecnico_id = self._resolve_technician_id(tecnico_id)
-        if not tecnico_id:
-            raise ValueError("ID tecnico mancante: inserisci l'ID del record Zoho per il tecnico")
+        record_id = (result.get("data") or {}).get("ID")
+        if not record_id:
+            # Senza ID non si puo' aggiornare in locale: risincronizza subito
+            self.sync_calendar()
+            return result
 
-        start_dt = self._format_datetime(data_str, ora_inizio)
-        end_dt = self._format_datetime(data_str, ora_fine)
+        record = dict(event_data, ID=str(record_id))
+        record["LkpTecnico"] = self._technician_lookup(event_data["LkpTecnico"])
+        self._apply_local_change(record_id, Event.from_record(record))
+        self._schedule_reconcile()
+        return result
 
-        event_data = {
-            "Titolo": titolo,
-            "LkpTecnico": tecnico_id,
-            # Format per Creator (date/time)
-            "Data": self._format_date_zoho(data_str),
-            "DataInizio": self._format_datetime_zoho(data_str, ora_inizio),
-            "DataFine": self._format_datetime_zoho(data_str, ora_fine),
-            "DescrizioneAttivita": descrizione,
-            "Tipologia": defaults["tipologia"],
-            "OrePianificate": defaults["ore_pianificate"],
-        }
-        if defaults["attivita_interna_id"]:
-            event_data["LkpAttivitaInterna"] = defaults["attivita_interna_id"]
-        if defaults["reparto"]:
-            event_data["Reparto"] = defaults["reparto"]
+    def create_events(self, items):
+        """Crea piu' eventi con inserimenti multipli Zoho e una sola sync finale.
 
-        result = self.zoho.create_event(event_data)
-        # Risincronizza
-        self.sync_calendar()
-        return result
+        `items` e' una lista di dict con le chiavi di `create_event`.
+        Restituisce un esito per elemento: {"index", "ok", "id"|"error"}.
+        """
+        results = [None] * len(items)
+        records, indexes = [], []
+        for i, item in enumerate(items):
+            try:
+                records.append(self._build_event_data(**item))
+                indexes.append(i)
+            except (TypeError, ValueError) as e:
+                results[i] = {"index": i, "ok": False, "error": str(e)}
+
+        if records:
+            for i, res in zip(indexes, self.zoho.create_events(records)):
+                if res.get("code") == 3000:
+                    record_id = (res.get("data") or {}).get("ID", "")
+                    results[i] = {"index": i, "ok": True, "id": record_id}
+                else:
+                    error = res.get("error") or res.get("message") or res
+                    results[i] = {"index": i, "ok": False, "error": str(error)}
+
+        created = sum(1 for r in results if r["ok"])
+        logger.info("Creazione multipla: %d/%d eventi creati", created, len(items))
+        if created:
+            self.sync_calendar()
+        return results
 
     def update_event(self, record_id, fields):
         """Aggiorna un evento esistente su Zoho Creator."""
-        result = self.zoho.update_event(record_id, fields)
-        self.sync_calendar()
+        current = self._find_record(record_id)
+        zoho_fields = self._to_zoho_fields(fields, current)
+        result = self.zoho.update_event(record_id, zoho_fields)
+
+        if current is None:
+            # Record non in memoria (es. data fuori finestra): riconcilia
+            self.cache.invalidate_record(record_id)
+        else:
+            record = dict(current.to_record(), **zoho_fields)
+            if "LkpTecnico" in zoho_fields:
+                record["LkpTecnico"] = self._technician_lookup(zoho_fields["LkpTecnico"])
+            self._apply_local_change(record_id, Event.from_record(record))
+        self._schedule_reconcile()
         return result
 
     def delete_event(self, record_id):
         """Elimina un evento su Zoho Creator."""
         result = self.zoho.delete_event(record_id)
-        self.sync_calendar()
+        self._apply_local_change(record_id, None)
+        # Le eliminazioni non compaiono nel delta: serve una sync completa
+        self._schedule_reconcile(full=True)
         return result
 
+    def _apply_local_change(self, record_id, record):
+        """Applica al set locale un evento creato/modificato (None = eliminato).
+
+        Ripubblica via MQTT solo i tecnici coinvolti.
+        """
+        record_id = str(record_id)
+        today = date.today().isoformat()
+        if record is not None and not self._filter_events([record]):
+            record = None
+
+        affected = set()
+        with self._events_lock:
+            events = []
+            for ev in self._events:
+                if ev.id == record_id:
+                    affected.add(ev.technician)
+                else:
+                    events.append(ev)
+            by_date = {}
+            if record is not None:
+                by_date[record.day] = [record]
+                if record.day == today:
+                    events.append(record)
+                    affected.add(record.technician)
+            self._set_today_events(events)
+            self.cache.merge([record_id], by_date)
+
+        configured = {t["name"] for t in self.technicians}
+        for name in affected & configured:
+            self._publish_technician(name)
+        self.mqtt.update_general(len(events), self._last_sync)
+        self.changes.notify("write")
+        self._prepare_payloads()
+
+    def _schedule_reconcile(self, full=False):
+        """Programma una sync di riconciliazione (debounce delle scritture)."""
+        with self._events_lock:
+            self._reconcile_full = self._reconcile_full or full
+            if self._reconcile_timer:
+                self._reconcile_timer.cancel()
+            self._reconcile_timer = threading.Timer(self.reconcile_delay, self._reconcile)
+            self._reconcile_timer.daemon = True
+            self._reconcile_timer.start()
+
+    def _reconcile(self):
+        with self._events_lock:
+            full = self._reconcile_full
+            self._reconcile_full = False
+            self._reconcile_timer = None
+        self.sync_calendar(full=full)
+
     # ------------------------------------------------------------------
     # Helpers
     # ------------------------------------------------------------------
 
-    def _transform_events(self, raw_events):
-        """Trasforma eventi Zoho Creator nel formato API."""
-        transformed = []
-        for ev in raw_events:
-            tech_name = ev.get("LkpTecnico", {}).get("Nominativo", "Sconosciuto")
-            transformed.append({
-                "id": ev.get("ID", ""),
-                "title": ev.get("Titolo", ""),
-                "description": ev.get("DescrizioneAttivita", ""),
-                "technician": tech_name,
-                "date": ev.get("Data", ""),
-                "start_time": ev.get("DataInizio", ""),
-                "end_time": ev.get("DataFine", ""),
-                "type": ev.get("Tipologia", ""),
-                "hours": ev.get("OrePianificate", ""),
-                "department": ev.get("Reparto", ""),
-            })
-        return transformed
+    @staticmethod
+    def _transform_events(events):
+        """Trasforma gli eventi normalizzati nel formato API."""
+        return [ev.to_api() for ev in events]
+
+    def _ingest(self, raw_events):
+        """Normalizza i record letti da Zoho e li filtra per tecnico."""
+        return self._filter_events(map(Event.from_record, raw_events))
 
-    def _filter_events(self, raw_events):
+    def _filter_events(self, events):
         """Filtra eventi per tecnici configurati (id o nome) ed esclude utenti noti."""
-        allowed_ids = {t.get("id") for t in self.technicians if t.get("id")}
+        allowed_ids = {str(t.get("id")) for t in self.technicians if t.get("id")}
         allowed_names = {t.get("name") for t in self.technicians if t.get("name")}
         filtered = []
-        for ev in raw_events:
-            tech = ev.get("LkpTecnico", {}) or {}
-            name = tech.get("Nominativo", "")
-            tech_id = tech.get("ID", "") or tech.get("id", "")
-            if name in EXCLUDED_USERS:
+        for ev in events:
+            if ev.technician in EXCLUDED_USERS:
                 continue
             if allowed_ids:
-                if tech_id in allowed_ids:
+                if ev.technician_id in allowed_ids:
                     filtered.append(ev)
                 continue
             if allowed_names:
-                if name in allowed_names:
+                if ev.technician in allowed_names:
                     filtered.append(ev)
         return filtered
 
+    def _build_event_data(self, titolo, tecnico_id, data_str, ora_inizio,
+                          ora_fine, descrizione=""):
+        """Record Zoho per un nuovo evento, con i default della configurazione."""
+        defaults = self.config_manager.get_event_defaults()
+
+        tecnico_id = self._resolve_technician_id(tecnico_id)
+        if not tecnico_id:
+            raise ValueError("ID tecnico mancante: inserisci l'ID del record Zoho per il tecnico")
+
+        event_data = {
+            "Titolo": titolo,
+            "LkpTecnico": tecnico_id,
+            # Format per Creator (date/time)
+            "Data": self._format_date_zoho(data_str),
+            "DataInizio": self._format_datetime_zoho(data_str, ora_inizio),
+            "DataFine": self._format_datetime_zoho(data_str, ora_fine),
+            "DescrizioneAttivita": descrizione,
+            "Tipologia": defaults["tipologia"],
+            "OrePianificate": defaults["ore_pianificate"],
+        }
+        if defaults["attivita_interna_id"]:
+            event_data["LkpAttivitaInterna"] = defaults["attivita_interna_id"]
+        if defaults["reparto"]:
+            event_data["Reparto"] = defaults["reparto"]
+        return event_data
+
+    def _find_record(self, record_id):
+        """Cerca un evento per ID negli eventi di oggi e nella cache."""
+        record_id = str(record_id)
+        for ev in self._events:
+            if ev.id == record_id:
+                return ev
+        return self.cache.find_record(record_id)
+
+    def _to_zoho_fields(self, fields, current=None):
+        """Converte i campi della dashboard nei campi Zoho (gli altri passano invariati).
+
+        Solleva ValueError se un campo non e' convertibile (tecnico sconosciuto,
+        orario senza data nota): la modifica non viene inviata.
+        """
+        zoho_fields = {}
+        date_str = fields.get("data") or (current.day if current else "")
+        for key, value in fields.items():
+            if key == "titolo":
+                zoho_fields["Titolo"] = value
+            elif key == "descrizione":
+                zoho_fields["DescrizioneAttivita"] = value
+            elif key == "tecnico_id":
+                tecnico_id = self._resolve_technician_id(value)
+                if not tecnico_id:
+                    raise ValueError(f"Tecnico sconosciuto: {value}")
+                zoho_fields["LkpTecnico"] = tecnico_id
+            elif key == "data":
+                zoho_fields["Data"] = self._format_date_zoho(value)
+            elif key in ("ora_inizio", "ora_fine"):
+                if not date_str:
+                    raise ValueError(
+                        f"Campo '{key}' senza data: specificare anche 'data' "
+                        "(evento non presente in locale)"
+                    )
+                zoho_key = "DataInizio" if key == "ora_inizio" else "DataFine"
+                zoho_fields[zoho_key] = self._format_datetime_zoho(date_str, value)
+            else:
+                zoho_fields[key] = value
+        return zoho_fields
+
+    def _technician_lookup(self, tecnico_id):
+        """Valore LkpTecnico come restituito dal report (ID + Nominativo)."""
+        for tech in self.technicians:
+            if tech.get("id") and str(tech["id"]) == str(tecnico_id):
+                return {"ID": str(tecnico_id), "Nominativo": tech.get("name", "")}
+        return {"ID": str(tecnico_id), "Nominativo": ""}
+
+    def _technician_name(self, tecnico_id):
+        """Nome del tecnico configurato (ID o nome), stringa vuota se sconosciuto."""
+        return self._technician_lookup(self._resolve_technician_id(tecnico_id))["Nominativo"]
+
     def _resolve_technician_id(self, tecnico_id):
         """Risolve l'ID tecnico se e' stato passato il nome."""
         if not tecnico_id:
@@ -327,36 +1174,11 @@ class CalendarManager:
         except ValueError:
             return CalendarManager._format_datetime(date_str, time_str)
 
-    @staticmethod
-    def _get_technician_status(name, events):
-        """Calcola lo stato attuale di un tecnico."""
-        if not events:
-            return "libero"
-
-        now = datetime.now()
-        for ev in events:
-            title = ev.get("Titolo", "").lower()
-            if "ferie" in title or "permesso" in title:
-                return "ferie"
-            if "malattia" in title:
-                return "malattia"
-
-            start_str = ev.get("DataInizio", "")
-            end_str = ev.get("DataFine", "")
-            try:
-                parts_s = start_str.split(":")
-                parts_e = end_str.split(":")
-                start = now.replace(
-                    hour=int(parts_s[0]), minute=int(parts_s[1]),
-                    second=0, microsecond=0,
-                )
-                end = now.replace(
-                    hour=int(parts_e[0]), minute=int(parts_e[1]),
-                    second=0, microsecond=0,
-                )
-                if start <= now <= end:
-                    return "occupato"
-            except (ValueError, IndexError):
-                pass
-
+    def _get_technician_status(self, name, now=None):
+        """Calcola lo stato attuale di un tecnico dall'indice degli eventi di oggi."""
+        absence = self._index.absence(name)
+        if absence:
+            return absence
+        if self._index.active_at(name, now or datetime.now()):
+            return "occupato"
         return "libero"
@@ -0,0 +1,135 @@
+"""
+Call Budget
+
+Contabilita' delle chiamate API Zoho Creator per categoria rispetto alla
+quota giornaliera dell'organizzazione, con una riserva dedicata alle
+scritture. Con budget basso l'add-on passa in modalita' degradata
+(letture dalla cache, sync diradate).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+BUDGET_FILE = "/config/zoho_budget.json"
+
+# Categorie che non consumano quota Creator (endpoint OAuth)
+UNCHARGED_CATEGORIES = {"token"}
+
+# Intervallo minimo tra due salvataggi su disco (secondi)
+SAVE_INTERVAL = 60
+
+
+class CallBudget:
+    def __init__(self, daily_quota=0, write_reserve=0.1, low_threshold=0.2):
+        """`daily_quota` = 0 disabilita i limiti (solo conteggio)."""
+        self.daily_quota = daily_quota
+        self.write_reserve = int(daily_quota * write_reserve)
+        self.low_threshold = int(daily_quota * low_threshold)
+
+        self._day = date.today().isoformat()
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Contabilita'
+    # ------------------------------------------------------------------
+
+    def allow(self, category):
+        """True se una chiamata della categoria puo' essere effettuata."""
+        if not self.daily_quota or category in UNCHARGED_CATEGORIES:
+            return True
+        remaining = self.remaining()
+        if category == "write":
+            return remaining > 0
+        # Le letture non possono intaccare la riserva per le scritture
+        return remaining > self.write_reserve
+
+    def record(self, category):
+        with self._lock:
+            self._rollover()
+            self._counts[category] = self._counts.get(category, 0) + 1
+        self._save()
+
+    def used(self):
+        with self._lock:
+            self._rollover()
+            return sum(
+                n for cat, n in self._counts.items()
+                if cat not in UNCHARGED_CATEGORIES
+            )
+
+    def remaining(self):
+        if not self.daily_quota:
+            return None
+        return max(self.daily_quota - self.used(), 0)
+
+    def is_low(self):
+        """Budget sotto la soglia: letture dalla cache e sync diradate."""
+        if not self.daily_quota:
+            return False
+        return self.remaining() <= self.write_reserve + self.low_threshold
+
+    def reads_exhausted(self):
+        return not self.allow("read")
+
+    def status(self):
+        with self._lock:
+            self._rollover()
+            counts = dict(self._counts)
+        return {
+            "day": self._day,
+            "daily_quota": self.daily_quota or None,
+            "used": self.used(),
+            "remaining": self.remaining(),
+            "write_reserve": self.write_reserve,
+            "by_category": counts,
+            "degraded": self.is_low(),
+        }
+
+    # ------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------
+
+    def _rollover(self):
+        """Azzera i contatori al cambio di giorno (lock gia' acquisito)."""
+        today = date.today().isoformat()
+        if today != self._day:
+            logger.info("Budget API: nuovo giorno, contatori azzerati")
+            self._day = today
+            self._counts = {}
+
+    def _load(self):
+        if not os.path.exists(BUDGET_FILE):
+            return
+        try:
+            with open(BUDGET_FILE, "r") as f:
+                data = json.load(f)
+            if data.get("day") == self._day:
+                self._counts = {k: int(v) for k, v in data.get("counts", {}).items()}
+                logger.info("Budget API caricato: %d chiamate oggi", self.used())
+        except (json.JSONDecodeError, OSError, ValueError, AttributeError):
+            pass
+
+    def _save(self):
+        now = time.time()
+        if now - self._last_save < SAVE_INTERVAL:
+            return
+        self._last_save = now
+        with self._lock:
+            data = {"day": self._day, "counts": dict(self._counts)}
+        tmp_file = f"{BUDGET_FILE}.tmp"
+        try:
+            os.makedirs(os.path.dirname(BUDGET_FILE), exist_ok=True)
+            with open(tmp_file, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_file, BUDGET_FILE)
+        except OSError as e:
+            logger.warning("Impossibile salvare budget API: %s", e)
@@ -0,0 +1,40 @@
+"""
+Change Notifier
+
+Versione monotona dei dati esposti dall'add-on: ogni modifica (sync o
+scrittura) incrementa la versione e sveglia chi e' in attesa, come lo
+stream SSE /api/stream usato dall'integrazione Home Assistant.
+"""
+
+import threading
+import time
+
+
+class ChangeNotifier:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._last = {"version": 0, "reason": None, "ts": None}
+
+    @property
+    def version(self):
+        with self._cond:
+            return self._version
+
+    def notify(self, reason):
+        """Registra una modifica e sveglia tutti i thread in attesa."""
+        with self._cond:
+            self._version += 1
+            self._last = {"version": self._version, "reason": reason, "ts": time.time()}
+            self._cond.notify_all()
+
+    def wait(self, since_version, timeout=None):
+        """Attende una versione diversa da `since_version`.
+
+        Restituisce l'ultima modifica (dict) oppure None allo scadere del timeout.
+        """
+        with self._cond:
+            changed = self._cond.wait_for(
+                lambda: self._version != since_version, timeout=timeout
+            )
+            return dict(self._last) if changed else None
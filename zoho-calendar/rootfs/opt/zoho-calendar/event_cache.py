@@ -0,0 +1,225 @@
+"""
+Event Cache
+
+Cache in memoria degli eventi indicizzata per data, con finestra mobile
+(giorni passati/futuri), TTL per singolo giorno ed eviction LRU.
+Se configurato, un EventStore persistente fa da secondo livello
+(write-through; le date non in memoria vengono lette dall'archivio).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from interval_index import IntervalIndex
+
+logger = logging.getLogger(__name__)
+
+
+class EventCache:
+    def __init__(self, days_back=7, days_forward=30, ttl=900, max_days=60, store=None):
+        self.days_back = days_back
+        self.days_forward = days_forward
+        self.ttl = ttl
+        # La finestra deve stare tutta in memoria, altrimenti si auto-elimina
+        window_size = days_back + days_forward + 1
+        if max_days < window_size:
+            logger.warning(
+                "Cache eventi: max_days %d inferiore alla finestra, uso %d",
+                max_days, window_size,
+            )
+        self.max_days = max(max_days, window_size)
+        self.store = store
+
+        # date_str -> (eventi, timestamp caricamento)
+        self._entries = OrderedDict()
+        # date_str -> (lista eventi indicizzata, IntervalIndex)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Finestra
+    # ------------------------------------------------------------------
+
+    def window(self, today=None):
+        """Restituisce (primo, ultimo) giorno della finestra mobile."""
+        today = today or date.today()
+        return (
+            today - timedelta(days=self.days_back),
+            today + timedelta(days=self.days_forward),
+        )
+
+    def window_dates(self, today=None):
+        """Elenco delle date (YYYY-MM-DD) della finestra mobile."""
+        start, end = self.window(today)
+        days = (end - start).days + 1
+        return [(start + timedelta(days=i)).isoformat() for i in range(days)]
+
+    def stale_dates(self, today=None):
+        """Date della finestra assenti o scadute."""
+        now = time.time()
+        with self._lock:
+            return [
+                d for d in self.window_dates(today)
+                if d not in self._entries
+                or now - self._entries[d][1] >= self.ttl
+            ]
+
+    # ------------------------------------------------------------------
+    # Lettura / scrittura
+    # ------------------------------------------------------------------
+
+    def get_entry(self, date_str):
+        """(eventi, timestamp caricamento) per una data, scaduta o no; None se assente."""
+        with self._lock:
+            entry = self._entries.get(date_str)
+            if entry is not None:
+                self._entries.move_to_end(date_str)
+            elif self.store is not None:
+                entry = self.store.get_day(date_str)
+                if entry is not None:
+                    self._entries[date_str] = entry
+                    self._evict()
+            return entry
+
+    def get_index(self, date_str):
+        """IntervalIndex degli eventi di una data (ricostruito solo se cambiati).
+
+        None se la data non e' in cache.
+        """
+        entry = self.get_entry(date_str)
+        if entry is None:
+            return None
+        events = entry[0]
+        with self._lock:
+            cached = self._indexes.get(date_str)
+        if cached is not None and cached[0] is events:
+            return cached[1]
+        index = IntervalIndex(events)
+        with self._lock:
+            self._indexes[date_str] = (events, index)
+        return index
+
+    def is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl
+
+    def put(self, date_str, events, fetched_at=None):
+        """Memorizza gli eventi di una data (resetta il TTL)."""
+        fetched_at = fetched_at or time.time()
+        events = list(events)
+        with self._lock:
+            previous = self._entries.get(date_str)
+            self._entries[date_str] = (events, fetched_at)
+            self._entries.move_to_end(date_str)
+            self._evict()
+        if self.store is not None:
+            # Eventi invariati (caso tipico della sync): aggiorna solo il timestamp
+            if previous is not None and previous[0] == events:
+                self.store.touch_day(date_str, fetched_at)
+            else:
+                self.store.put_day(date_str, events, fetched_at)
+
+    def put_many(self, events_by_date):
+        """Memorizza piu' date insieme (una sola transazione sull'archivio)."""
+        fetched_at = time.time()
+        with self._lock:
+            for date_str, events in events_by_date.items():
+                self._entries[date_str] = (list(events), fetched_at)
+                self._entries.move_to_end(date_str)
+            self._evict()
+        if self.store is not None:
+            self.store.put_days(events_by_date, fetched_at)
+
+    def load_window(self, today=None):
+        """Carica dall'archivio i giorni della finestra (avvio a caldo).
+
+        Restituisce il numero di giorni caricati.
+        """
+        if self.store is None:
+            return 0
+        start, end = self.window(today)
+        days = self.store.get_days(start.isoformat(), end.isoformat())
+        with self._lock:
+            for date_str, entry in sorted(days.items()):
+                self._entries.setdefault(date_str, entry)
+            self._evict()
+        return len(days)
+
+    def merge(self, changed_ids, records_by_date):
+        """Applica un delta ai giorni in cache senza resettarne il TTL.
+
+        Gli eventi con ID in `changed_ids` vengono rimossi da ogni giorno,
+        poi `records_by_date` (date_str -> eventi) viene aggiunto ai giorni
+        gia' presenti. I giorni non in cache verranno caricati al prossimo miss.
+        """
+        changed_ids = {str(i) for i in changed_ids}
+        with self._lock:
+            for date_str, (events, fetched_at) in list(self._entries.items()):
+                merged = [ev for ev in events if ev.id not in changed_ids]
+                merged.extend(records_by_date.get(date_str, []))
+                self._entries[date_str] = (merged, fetched_at)
+        if self.store is not None:
+            self.store.merge(changed_ids, records_by_date)
+
+    def invalidate_record(self, record_id):
+        """Rimuove dalla cache i giorni che contengono il record."""
+        record_id = str(record_id)
+        with self._lock:
+            dates = [
+                d for d, (events, _) in self._entries.items()
+                if any(ev.id == record_id for ev in events)
+            ]
+            for d in dates:
+                del self._entries[d]
+                self._indexes.pop(d, None)
+        if self.store is not None:
+            self.store.invalidate_record(record_id)
+        return dates
+
+    def find_record(self, record_id):
+        """Cerca un record per ID tra i giorni in cache."""
+        record_id = str(record_id)
+        with self._lock:
+            for events, _ in self._entries.values():
+                for ev in events:
+                    if ev.id == record_id:
+                        return ev
+        if self.store is not None:
+            return self.store.find_record(record_id)
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _evict(self):
+        """Elimina le date meno usate oltre max_days (lock gia' acquisito).
+
+        Le date fuori finestra (es. storico letto dall'archivio) escono per
+        prime: i giorni della finestra non vanno riscaricati al prefetch.
+        """
+        excess = len(self._entries) - self.max_days
+        if excess <= 0:
+            return
+        window = set(self.window_dates())
+        victims = [d for d in self._entries if d not in window][:excess]
+        if len(victims) < excess:
+            # Finestra spostata (cambio giorno): poi le date meno usate
+            victims += [d for d in self._entries if d in window][:excess - len(victims)]
+        for evicted in victims:
+            del self._entries[evicted]
+            self._indexes.pop(evicted, None)
+            logger.debug("Cache eventi: eviction %s", evicted)
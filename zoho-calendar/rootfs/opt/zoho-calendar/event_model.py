@@ -0,0 +1,187 @@
+"""
+Event Model
+
+Record evento normalizzato una sola volta all'ingresso (lettura da Zoho,
+archivio locale o scrittura): date e orari gia' convertiti in datetime,
+tecnico e stato gia' estratti, stringhe ripetute internate. MQTT, stato
+tecnici, API REST e filtri lavorano su questi oggetti senza rileggere le
+stringhe Zoho.
+"""
+
+import sys
+from datetime import datetime, time as dtime
+
+# Formati data accettati per il campo Data
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%b-%Y", "%d-%m-%Y")
+
+# Formati data/ora accettati per DataInizio / DataFine
+DATETIME_FORMATS = (
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%d-%b-%Y %H:%M:%S",
+    "%d-%b-%Y %H:%M",
+    "%d-%m-%Y %H:%M:%S",
+    "%d-%m-%Y %H:%M",
+)
+
+UNKNOWN_TECHNICIAN = "Sconosciuto"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else ""
+
+
+def parse_date(value):
+    """Data di un record Zoho (qualunque formato) -> date, None se non valida."""
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_datetime(value, day=None):
+    """Orario di un record Zoho -> datetime.
+
+    Accetta data e ora nei formati Zoho/ISO oppure solo "HH:MM", che viene
+    riferito a `day`. None se vuoto o non valido.
+    """
+    value = (value or "").strip().replace("T", " ")
+    if not value:
+        return None
+    try:
+        # ISO con eventuale offset: orario locale di Zoho
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    if day is None:
+        return None
+    try:
+        parts = value.rsplit(" ", 1)[-1].split(":")
+        hour = int(parts[0])
+        minute = int(parts[1][:2]) if len(parts) > 1 else 0
+        return datetime.combine(day, dtime(hour, minute))
+    except (ValueError, IndexError):
+        return None
+
+
+def status_from_title(title):
+    """Stato del tecnico durante un evento, dedotto dal titolo."""
+    title_lower = title.lower()
+    if "ferie" in title_lower or "permesso" in title_lower:
+        return "ferie"
+    if "malattia" in title_lower:
+        return "malattia"
+    if "reperibilit" in title_lower:
+        return "reperibilita"
+    return "occupato"
+
+
+class Event:
+    """Evento normalizzato (immutabile per convenzione)."""
+
+    __slots__ = (
+        "id", "title", "description", "technician", "technician_id",
+        "day", "start", "end", "status", "type", "department", "hours",
+        "date_text", "start_text", "end_text",
+    )
+
+    def __init__(self, id, title, description, technician, technician_id,
+                 day, start, end, type="", department="", hours="",
+                 date_text="", start_text="", end_text=""):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.technician = _intern(technician)
+        self.technician_id = _intern(technician_id)
+        # Giorno ISO (YYYY-MM-DD), chiave di cache e archivio
+        self.day = day
+        self.start = start
+        self.end = end
+        self.status = sys.intern(status_from_title(title))
+        self.type = _intern(type)
+        self.department = _intern(department)
+        self.hours = hours
+        # Valori originali Zoho, restituiti invariati da API e MQTT
+        self.date_text = date_text
+        self.start_text = start_text
+        self.end_text = end_text
+
+    @classmethod
+    def from_record(cls, record):
+        """Normalizza un record Zoho (report, archivio o scrittura locale)."""
+        lookup = record.get("LkpTecnico") or {}
+        if not isinstance(lookup, dict):
+            lookup = {"ID": str(lookup)}
+        date_text = record.get("Data") or ""
+        day = parse_date(date_text)
+        start_text = record.get("DataInizio") or ""
+        end_text = record.get("DataFine") or ""
+        return cls(
+            id=str(record.get("ID", "")),
+            title=record.get("Titolo") or "",
+            description=record.get("DescrizioneAttivita") or "",
+            technician=lookup.get("Nominativo", UNKNOWN_TECHNICIAN),
+            technician_id=str(lookup.get("ID", "") or lookup.get("id", "")),
+            day=day.isoformat() if day else "",
+            start=parse_datetime(start_text, day),
+            end=parse_datetime(end_text, day),
+            type=record.get("Tipologia") or "",
+            department=record.get("Reparto") or "",
+            hours=record.get("OrePianificate", ""),
+            date_text=date_text,
+            start_text=start_text,
+            end_text=end_text,
+        )
+
+    def to_record(self):
+        """Record in formato Zoho (persistenza e merge delle modifiche)."""
+        return {
+            "ID": self.id,
+            "Titolo": self.title,
+            "DescrizioneAttivita": self.description,
+            "LkpTecnico": {"ID": self.technician_id, "Nominativo": self.technician},
+            "Data": self.date_text,
+            "DataInizio": self.start_text,
+            "DataFine": self.end_text,
+            "Tipologia": self.type,
+            "Reparto": self.department,
+            "OrePianificate": self.hours,
+        }
+
+    def to_api(self):
+        """Formato restituito dalle API REST."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+            "technician": self.technician,
+            "date": self.date_text,
+            "start_time": self.start_text,
+            "end_time": self.end_text,
+            "type": self.type,
+            "hours": self.hours,
+            "department": self.department,
+        }
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Event):
+            return NotImplemented
+        return self._key() == other._key()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Event({self.id!r}, {self.technician!r}, {self.start_text!r}-{self.end_text!r})"
@@ -0,0 +1,201 @@
+"""
+Event Store
+
+Archivio persistente degli eventi (SQLite su /config) indicizzato per data,
+tecnico e ID record. Sopravvive ai riavvii dell'add-on: all'avvio i dati
+sono subito disponibili e le date gia' lette non costano chiamate Zoho.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from event_model import Event
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "/config/zoho_events.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    technician TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events (date);
+CREATE INDEX IF NOT EXISTS idx_events_technician ON events (technician, date);
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class EventStore:
+    def __init__(self, path=None, retention_days=365):
+        """`retention_days` = 0 conserva tutto lo storico."""
+        self.path = path or STORE_FILE
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            logger.info("Archivio eventi: %s", self.path)
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            # Senza /config scrivibile l'add-on funziona comunque (solo memoria)
+            logger.warning("Archivio eventi non disponibile (%s), uso memoria: %s", self.path, e)
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            conn.executescript(SCHEMA)
+            return conn
+
+    # ------------------------------------------------------------------
+    # Lettura
+    # ------------------------------------------------------------------
+
+    def get_day(self, date_str):
+        """(eventi, timestamp caricamento) per una data gia' letta, altrimenti None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at FROM days WHERE date = ?", (date_str,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT record FROM events WHERE date = ?", (date_str,)
+            ).fetchall()
+        return [Event.from_record(json.loads(r[0])) for r in rows], row[0]
+
+    def get_days(self, start, end):
+        """date_str -> (eventi, timestamp) per le date lette nell'intervallo."""
+        with self._lock:
+            days = self._conn.execute(
+                "SELECT date, fetched_at FROM days WHERE date BETWEEN ? AND ?",
+                (start, end),
+            ).fetchall()
+            rows = self._conn.execute(
+                "SELECT date, record FROM events WHERE date BETWEEN ? AND ?",
+                (start, end),
+            ).fetchall()
+        result = {d: ([], fetched_at) for d, fetched_at in days}
+        for d, record in rows:
+            if d in result:
+                result[d][0].append(Event.from_record(json.loads(record)))
+        return result
+
+    def find_record(self, record_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM events WHERE id = ?", (str(record_id),)
+            ).fetchone()
+        return Event.from_record(json.loads(row[0])) if row else None
+
+    def technician_events(self, technician, start, end):
+        """Eventi di un tecnico tra due date (incluse)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM events WHERE technician = ? AND date BETWEEN ? AND ?"
+                " ORDER BY date",
+                (technician, start, end),
+            ).fetchall()
+        return [Event.from_record(json.loads(r[0])) for r in rows]
+
+    # ------------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------------
+
+    def put_day(self, date_str, events, fetched_at=None):
+        """Sostituisce gli eventi di una data."""
+        self.put_days({date_str: events}, fetched_at)
+
+    def put_days(self, events_by_date, fetched_at=None):
+        """Sostituisce gli eventi di piu' date in un'unica transazione."""
+        fetched_at = fetched_at or time.time()
+        dates = list(events_by_date)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM events WHERE date = ?", [(d,) for d in dates]
+            )
+            self._insert(
+                (d, ev) for d, events in events_by_date.items() for ev in events
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO days (date, fetched_at) VALUES (?, ?)",
+                [(d, fetched_at) for d in dates],
+            )
+
+    def touch_day(self, date_str, fetched_at=None):
+        """Aggiorna solo il timestamp di una data (eventi invariati)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO days (date, fetched_at) VALUES (?, ?)",
+                (date_str, fetched_at if fetched_at is not None else time.time()),
+            )
+
+    def merge(self, changed_ids, records_by_date):
+        """Applica un delta: rimuove `changed_ids` e inserisce i nuovi record."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM events WHERE id = ?", [(str(i),) for i in changed_ids]
+            )
+            self._insert(
+                (d, ev) for d, events in records_by_date.items() for ev in events
+            )
+
+    def invalidate_record(self, record_id):
+        """Marca come scadute le date che contengono il record."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE days SET fetched_at = 0"
+                " WHERE date IN (SELECT date FROM events WHERE id = ?)",
+                (str(record_id),),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM events")
+            self._conn.execute("DELETE FROM days")
+
+    def prune(self, today=None):
+        """Elimina i giorni piu' vecchi della retention."""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = ((today or date.today()) - timedelta(days=self.retention_days)).isoformat()
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM events WHERE date < ?", (cutoff,)
+            ).rowcount
+            self._conn.execute("DELETE FROM days WHERE date < ?", (cutoff,))
+        if removed:
+            logger.info("Archivio eventi: rimossi %d eventi prima del %s", removed, cutoff)
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _insert(self, dated_records):
+        """Inserisce (date_str, evento) (lock e transazione gia' acquisiti)."""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO events (id, date, technician, record)"
+            " VALUES (?, ?, ?, ?)",
+            [
+                (ev.id, d, ev.technician, json.dumps(ev.to_record()))
+                for d, ev in dated_records
+            ],
+        )
@@ -0,0 +1,116 @@
+"""
+Interval Index
+
+Indice degli eventi di un giorno per tecnico: intervalli ordinati per
+inizio con il massimo progressivo delle fine, per rispondere in O(log n)
+a "e' libero tra A e B?", "cosa sta facendo adesso?" e "qual e' il
+prossimo evento?". Ferie e malattia rendono il tecnico assente per il giorno.
+"""
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import attrgetter
+
+# Stati che rendono il tecnico non disponibile per l'intera giornata
+ABSENCE_STATUSES = ("ferie", "malattia")
+
+
+def free_slots(events, start, end, duration):
+    """Slot liberi di almeno `duration` in [start, end), con una sola passata.
+
+    `events` deve essere ordinato per inizio (es. il risultato di
+    IntervalIndex.overlapping). Restituisce una lista di (inizio, fine).
+    """
+    slots = []
+    cursor = start
+    for ev in events:
+        gap_end = min(ev.start, end)
+        if gap_end - cursor >= duration:
+            slots.append((cursor, gap_end))
+        if ev.end > cursor:
+            cursor = ev.end
+        if cursor >= end:
+            return slots
+    if end - cursor >= duration:
+        slots.append((cursor, end))
+    return slots
+
+
+class _Intervals:
+    __slots__ = ("events", "starts", "max_ends")
+
+    def __init__(self, events):
+        self.events = sorted(events, key=attrgetter("start"))
+        self.starts = [ev.start for ev in self.events]
+        # max_ends[i] = fine piu' tarda tra gli eventi 0..i (non decrescente)
+        self.max_ends = list(accumulate((ev.end for ev in self.events), max))
+
+
+class IntervalIndex:
+    def __init__(self, events=()):
+        by_tech = {}
+        self._absent = {}
+        for ev in events:
+            if ev.status in ABSENCE_STATUSES:
+                self._absent.setdefault(ev.technician, ev)
+            if ev.start is None or ev.end is None or ev.end < ev.start:
+                continue
+            by_tech.setdefault(ev.technician, []).append(ev)
+        self._intervals = {name: _Intervals(evs) for name, evs in by_tech.items()}
+
+    def absence(self, technician):
+        """'ferie' / 'malattia' se il tecnico e' assente nel giorno, altrimenti None."""
+        ev = self._absent.get(technician)
+        return ev.status if ev else None
+
+    def absence_event(self, technician):
+        """Evento di ferie/malattia del tecnico nel giorno, o None."""
+        return self._absent.get(technician)
+
+    def is_free(self, technician, start, end, absences=True):
+        """True se nessun evento del tecnico si sovrappone a [start, end)."""
+        if absences and technician in self._absent:
+            return False
+        entry = self._intervals.get(technician)
+        if entry is None:
+            return True
+        i = bisect_left(entry.starts, end)
+        return i == 0 or entry.max_ends[i - 1] <= start
+
+    def overlapping(self, technician, start, end):
+        """Eventi che si sovrappongono a [start, end), ordinati per inizio."""
+        entry = self._intervals.get(technician)
+        if entry is None:
+            return []
+        found = []
+        j = bisect_left(entry.starts, end) - 1
+        # Risalendo, appena il massimo delle fine e' <= start non ci sono altri candidati
+        while j >= 0 and entry.max_ends[j] > start:
+            if entry.events[j].end > start:
+                found.append(entry.events[j])
+            j -= 1
+        found.reverse()
+        return found
+
+    def active_at(self, technician, when):
+        """Eventi in corso all'istante `when` (estremi inclusi)."""
+        entry = self._intervals.get(technician)
+        if entry is None:
+            return []
+        found = []
+        j = bisect_right(entry.starts, when) - 1
+        while j >= 0 and entry.max_ends[j] >= when:
+            if entry.events[j].end >= when:
+                found.append(entry.events[j])
+            j -= 1
+        found.reverse()
+        return found
+
+    def upcoming(self, technician, when):
+        """Primo evento (per inizio) non ancora terminato a `when`, o None."""
+        entry = self._intervals.get(technician)
+        if entry is None:
+            return None
+        # Il primo indice con max_ends > when e' proprio quell'evento
+        i = bisect_right(entry.max_ends, when)
+        return entry.events[i] if i < len(entry.events) else None
@@ -0,0 +1,161 @@
+"""
+Metrics
+
+Contatori e istogrammi minimali esposti in formato testo Prometheus
+su /api/metrics (senza dipendenze esterne).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [conteggi per bucket, somma, totale]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Misura la durata del blocco `with`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        for key, (counts, total, count) in items:
+            for bound, value in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {value}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """Tutte le metriche registrate in formato testo Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------
+# Metriche dell'add-on
+# ----------------------------------------------------------------------
+
+SYNC_PHASE_SECONDS = Histogram(
+    "zoho_calendar_sync_phase_seconds",
+    "Durata delle fasi della sync (token, fetch, filter, group, publish, total)",
+    ["phase", "mode"],
+)
+ZOHO_REQUEST_SECONDS = Histogram(
+    "zoho_calendar_zoho_request_seconds",
+    "Latenza delle chiamate HTTP a Zoho (retry inclusi)",
+    ["endpoint", "method"],
+)
+ZOHO_RESPONSES = Counter(
+    "zoho_calendar_zoho_responses_total",
+    "Risposte Zoho per endpoint e status code",
+    ["endpoint", "method", "status"],
+)
+ZOHO_COALESCED = Counter(
+    "zoho_calendar_zoho_coalesced_total",
+    "Letture Zoho evitate perche' identiche a una richiesta gia' in corso",
+    ["kind"],
+)
+TOKEN_REFRESHES = Counter(
+    "zoho_calendar_token_refresh_total",
+    "Rinnovi dell'access token Zoho",
+    ["result"],
+)
+MQTT_PUBLISHES = Counter(
+    "zoho_calendar_mqtt_publish_total",
+    "Messaggi MQTT pubblicati o saltati perche' invariati",
+    ["result"],
+)
+EVENTS_CACHE = Counter(
+    "zoho_calendar_events_cache_total",
+    "Letture eventi servite dalla cache (hit), dalla cache scaduta (stale) o da Zoho (miss)",
+    ["result"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "zoho_calendar_http_request_seconds",
+    "Latenza delle richieste HTTP all'add-on per route",
+    ["route", "method"],
+)
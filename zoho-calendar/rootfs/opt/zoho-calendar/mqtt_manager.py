@@ -4,16 +4,20 @@ MQTT Manager per Home Assistant
 Pubblica sensori via MQTT Discovery per ogni tecnico e sensori generali.
 """
 
+import hashlib
 import json
 import logging
 import os
 import re
+import threading
 import time
 import unicodedata
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -37,6 +41,10 @@ class MQTTManager:
         self._client = None
         self._connected = False
 
+        # Ultimo payload voluto per topic: topic -> (hash, payload, retain, inviato)
+        self._last_payloads = {}
+        self._publish_lock = threading.Lock()
+
     # ------------------------------------------------------------------
     # Connection
     # ------------------------------------------------------------------
@@ -76,7 +84,9 @@ class MQTTManager:
         if rc == 0:
             logger.info("Connesso al broker MQTT")
             self._connected = True
-            self._publish_discovery()
+            # Il broker potrebbe aver perso gli stati: ripubblica tutto
+            self._publish_discovery(force=True)
+            self._republish_all()
         else:
             logger.error("Connessione MQTT fallita (rc=%d)", rc)
 
@@ -93,7 +103,7 @@ class MQTTManager:
     # MQTT Discovery
     # ------------------------------------------------------------------
 
-    def _publish_discovery(self):
+    def _publish_discovery(self, force=False):
         """Pubblica configurazioni MQTT Discovery per tutti i sensori."""
         device_info = {
             "identifiers": ["zoho_calendar"],
@@ -150,7 +160,7 @@ class MQTTManager:
                     "icon": sensor["icon"],
                     "device": device_info,
                 }
-                self._publish(config_topic, payload, retain=True)
+                self._publish(config_topic, payload, retain=True, force=force)
 
         # Sensori generali
         general_sensors = [
@@ -182,7 +192,7 @@ class MQTTManager:
                 "icon": sensor["icon"],
                 "device": device_info,
             }
-            self._publish(config_topic, payload, retain=True)
+            self._publish(config_topic, payload, retain=True, force=force)
 
         logger.info(
             "Discovery MQTT pubblicata per %d tecnici + %d sensori generali",
@@ -193,38 +203,17 @@ class MQTTManager:
     # State updates
     # ------------------------------------------------------------------
 
-    def update_technician(self, tech_name, events):
-        """Aggiorna i sensori di un tecnico con i suoi eventi del giorno."""
-        slug = _slugify(tech_name)
-        now = datetime.now()
-
-        # Trova prossimo evento
-        future_events = [
-            e for e in events
-            if self._parse_time(e.get("DataFine", "")) > now
-        ]
-        future_events.sort(key=lambda e: self._parse_time(e.get("DataInizio", "")))
-
-        next_event = future_events[0] if future_events else None
-
-        # Stato attuale
-        current_events = [
-            e for e in events
-            if (self._parse_time(e.get("DataInizio", "")) <= now
-                <= self._parse_time(e.get("DataFine", "")))
-        ]
+    def update_technician(self, tech_name, events, current=(), next_event=None):
+        """Aggiorna i sensori di un tecnico con i suoi eventi del giorno.
 
-        if current_events:
-            stato = self._get_status_from_title(
-                current_events[0].get("Titolo", "")
-            )
-        elif not events:
-            stato = "libero"
-        else:
-            stato = "libero"
+        `current` (eventi in corso) e `next_event` (primo evento non ancora
+        terminato) vengono dall'indice per tecnico del CalendarManager.
+        """
+        slug = _slugify(tech_name)
+        stato = current[0].status if current else "libero"
 
         # Prossimo evento
-        next_title = next_event.get("Titolo", "Nessuno") if next_event else "Nessuno"
+        next_title = next_event.title if next_event else "Nessuno"
         self._publish(
             f"{self.prefix}/{slug}/prossimo_evento",
             next_title,
@@ -233,10 +222,10 @@ class MQTTManager:
             self._publish(
                 f"{self.prefix}/{slug}/prossimo_evento/attributes",
                 {
-                    "descrizione": next_event.get("DescrizioneAttivita", ""),
-                    "ora_inizio": next_event.get("DataInizio", ""),
-                    "ora_fine": next_event.get("DataFine", ""),
-                    "tipologia": next_event.get("Tipologia", ""),
+                    "descrizione": next_event.description,
+                    "ora_inizio": next_event.start_text,
+                    "ora_fine": next_event.end_text,
+                    "tipologia": next_event.type,
                 },
             )
         else:
@@ -254,9 +243,9 @@ class MQTTManager:
             {
                 "eventi": [
                     {
-                        "titolo": e.get("Titolo", ""),
-                        "inizio": e.get("DataInizio", ""),
-                        "fine": e.get("DataFine", ""),
+                        "titolo": e.title,
+                        "inizio": e.start_text,
+                        "fine": e.end_text,
                     }
                     for e in events
                 ],
@@ -267,11 +256,11 @@ class MQTTManager:
         self._publish(f"{self.prefix}/{slug}/stato", stato)
         self._publish(
             f"{self.prefix}/{slug}/stato/attributes",
-            {"attivita_corrente": current_events[0].get("Titolo", "") if current_events else ""},
+            {"attivita_corrente": current[0].title if current else ""},
         )
 
         # Orario prossimo
-        next_time = next_event.get("DataInizio", "N/A") if next_event else "N/A"
+        next_time = next_event.start_text if next_event else "N/A"
         self._publish(f"{self.prefix}/{slug}/orario_prossimo", next_time)
 
     def update_general(self, total_events, last_update=None):
@@ -290,39 +279,39 @@ class MQTTManager:
     # Helpers
     # ------------------------------------------------------------------
 
-    def _publish(self, topic, payload, retain=False):
-        if not self._client or not self._connected:
-            return
+    def _publish(self, topic, payload, retain=False, force=False):
+        """Pubblica solo se il payload e' cambiato rispetto all'ultimo invio.
+
+        Da disconnesso memorizza comunque l'ultimo payload voluto, inviato
+        alla riconnessione da _republish_all.
+        """
         if isinstance(payload, (dict, list)):
             payload = json.dumps(payload)
-        self._client.publish(topic, payload, retain=retain)
-
-    @staticmethod
-    def _parse_time(time_str):
-        """Converte orario in datetime di oggi (supporta valori con data)."""
-        if not time_str:
-            return datetime.min
-        try:
-            t = time_str.strip()
-            if "T" in t:
-                t = t.split("T", 1)[1]
-            if " " in t:
-                t = t.split(" ", 1)[1]
-            parts = t.split(":")
-            h = int(parts[0])
-            m = int(parts[1]) if len(parts) > 1 else 0
-            now = datetime.now()
-            return now.replace(hour=h, minute=m, second=0, microsecond=0)
-        except (ValueError, IndexError):
-            return datetime.min
-
-    @staticmethod
-    def _get_status_from_title(title):
-        title_lower = title.lower()
-        if "ferie" in title_lower or "permesso" in title_lower:
-            return "ferie"
-        if "malattia" in title_lower:
-            return "malattia"
-        if "reperibilit" in title_lower:
-            return "reperibilita"
-        return "occupato"
+        digest = hashlib.sha1(str(payload).encode("utf-8")).hexdigest()
+
+        with self._publish_lock:
+            if not self._client or not self._connected:
+                self._last_payloads[topic] = (digest, payload, retain, False)
+                return False
+            last = self._last_payloads.get(topic)
+            if not force and last and last[0] == digest and last[3]:
+                metrics.MQTT_PUBLISHES.inc(result="skipped")
+                return False
+            info = self._client.publish(topic, payload, retain=retain)
+            sent = info.rc == mqtt.MQTT_ERR_SUCCESS
+            self._last_payloads[topic] = (digest, payload, retain, sent)
+            metrics.MQTT_PUBLISHES.inc(result="published" if sent else "error")
+            return True
+
+    def _republish_all(self):
+        """Ripubblica l'ultimo stato voluto di ogni topic (es. dopo una riconnessione)."""
+        with self._publish_lock:
+            cached = [
+                (topic, payload, retain)
+                for topic, (_, payload, retain, _) in self._last_payloads.items()
+                if not topic.startswith("homeassistant/")
+            ]
+        for topic, payload, retain in cached:
+            self._publish(topic, payload, retain=retain, force=True)
+        if cached:
+            logger.info("Ripubblicati %d stati MQTT dopo la connessione", len(cached))
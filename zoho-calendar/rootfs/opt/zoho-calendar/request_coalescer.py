@@ -0,0 +1,57 @@
+"""
+Request Coalescer
+
+Accorpa le letture identiche in corso: i thread che chiedono la stessa
+chiave mentre una richiesta e' gia' in volo ne attendono l'esito invece di
+ripeterla, e ricevono lo stesso risultato (da trattare in sola lettura).
+"""
+
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    def __init__(self, on_shared=None):
+        """`on_shared(key)` viene richiamato per ogni chiamata accorpata."""
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._on_shared = on_shared
+
+    def run(self, key, fn):
+        """Esegue `fn()` una sola volta per chiave tra i chiamanti concorrenti.
+
+        Le eccezioni vengono propagate a tutti i thread in attesa.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if self._on_shared:
+                self._on_shared(key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Le richieste successive al completamento ripartono da Zoho
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
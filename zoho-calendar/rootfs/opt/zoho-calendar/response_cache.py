@@ -0,0 +1,61 @@
+"""
+Response Cache
+
+Corpi di risposta delle API serializzati una sola volta per versione dei
+dati: byte JSON, variante gzip ed ETag, immutabili. Le route restituiscono
+i byte gia' pronti invece di ricostruire, serializzare e comprimere il
+payload a ogni richiesta.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+
+from request_coalescer import RequestCoalescer
+
+# Sotto questa dimensione (byte) la compressione non conviene
+GZIP_MIN_SIZE = 512
+
+
+class Payload:
+    """Corpo JSON pre-serializzato (da trattare in sola lettura)."""
+
+    __slots__ = ("body", "gzipped", "etag", "etag_gzip")
+
+    def __init__(self, data):
+        # Stesse opzioni del provider JSON di Flask (chiavi ordinate, compatto)
+        self.body = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        self.gzipped = (
+            gzip.compress(self.body, compresslevel=6, mtime=0)
+            if len(self.body) >= GZIP_MIN_SIZE else None
+        )
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        # Rappresentazione diversa: ETag distinto per la variante compressa
+        self.etag_gzip = self.etag + "-gz" if self.gzipped is not None else None
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Richieste concorrenti dopo una modifica costruiscono il payload una volta
+        self._building = RequestCoalescer()
+
+    def get(self, key, stamp, build):
+        """Payload di `key` per la versione `stamp`; `build()` produce i dati se cambiata."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        return self._building.run((key, stamp), lambda: self._build(key, stamp, build))
+
+    def _build(self, key, stamp, build):
+        payload = Payload(build())
+        with self._lock:
+            self._entries[key] = (stamp, payload)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
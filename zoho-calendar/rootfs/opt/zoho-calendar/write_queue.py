@@ -0,0 +1,137 @@
+"""
+Write Queue
+
+Coda di scritture verso Zoho eseguita da un thread dedicato.
+Ogni operazione riceve un job ID consultabile per conoscerne l'esito;
+aggiornamenti consecutivi dello stesso record ancora in coda vengono fusi
+in un'unica chiamata.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+
+class WriteQueue:
+    def __init__(self, handler, max_jobs=500):
+        """`handler(action, record_id, payload)` esegue la scrittura vera e propria."""
+        self._handler = handler
+        self.max_jobs = max_jobs
+
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def submit(self, action, payload=None, record_id=None):
+        """Accoda una scrittura e restituisce lo snapshot del job."""
+        payload = dict(payload or {})
+        with self._cond:
+            if action == "update":
+                job = self._find_queued_update(record_id)
+                if job is not None:
+                    job["payload"].update(payload)
+                    job["merged"] += 1
+                    logger.info(
+                        "Aggiornamento %s fuso nel job %s", record_id, job["id"],
+                    )
+                    return self._snapshot(job)
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "action": action,
+                "record_id": record_id,
+                "payload": payload,
+                "status": STATUS_QUEUED,
+                "merged": 0,
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._jobs[job["id"]] = job
+            self._pending.append(job)
+            self._prune()
+            self._ensure_worker()
+            self._cond.notify()
+            return self._snapshot(job)
+
+    def get(self, job_id):
+        """Snapshot di un job, None se sconosciuto (o scaduto)."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _ensure_worker(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="write-queue"
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                job["status"] = STATUS_RUNNING
+
+            try:
+                result = self._handler(job["action"], job["record_id"], job["payload"])
+                status, error = STATUS_DONE, None
+            except Exception as e:
+                logger.exception("Errore job %s (%s)", job["id"], job["action"])
+                result, status, error = None, STATUS_ERROR, str(e)
+
+            with self._cond:
+                job["result"] = result
+                job["error"] = error
+                job["status"] = status
+                job["finished_at"] = time.time()
+
+    # ------------------------------------------------------------------
+    # Helpers (lock gia' acquisito)
+    # ------------------------------------------------------------------
+
+    def _find_queued_update(self, record_id):
+        for job in reversed(self._pending):
+            if job["record_id"] != record_id:
+                continue
+            # Solo se l'ultima operazione in coda sul record e' un update
+            return job if job["action"] == "update" else None
+        return None
+
+    def _prune(self):
+        """Scarta i job conclusi piu' vecchi oltre max_jobs."""
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]["status"] in (STATUS_DONE, STATUS_ERROR):
+                del self._jobs[job_id]
+                excess -= 1
+
+    @staticmethod
+    def _snapshot(job):
+        return {k: v for k, v in job.items() if k != "payload"}
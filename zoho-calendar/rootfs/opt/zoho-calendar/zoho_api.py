@@ -8,15 +8,59 @@ sul report CalendarioPianificazione di Zoho Creator.
 import json
 import logging
 import os
+import threading
 import time
+from contextlib import contextmanager
 from datetime import date, datetime
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from call_budget import CallBudget
+from request_coalescer import RequestCoalescer
 
 logger = logging.getLogger(__name__)
 
 TOKEN_CACHE_FILE = "/config/zoho_tokens.json"
 
+# Valori ammessi da Creator v2.1 per max_records: 200, 500, 1000
+DEFAULT_PAGE_SIZE = 1000
+
+# Formato data/ora usato nei criteri (es. Modified_Time)
+CRITERIA_DATETIME_FORMAT = os.environ.get("ZOHO_DATETIME_FORMAT", "%Y-%m-%d %H:%M:%S")
+
+# Anticipo (secondi) con cui il token viene rinnovato in background
+TOKEN_REFRESH_MARGIN = int(os.environ.get("ZOHO_TOKEN_REFRESH_MARGIN", "300"))
+
+# Numero massimo di record per singola richiesta di inserimento Creator
+BULK_INSERT_LIMIT = 200
+
+# Status per cui ritentare automaticamente (rate limit + errori server)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class _BudgetRetry(Retry):
+    """Retry urllib3 che segnala ogni nuovo tentativo (ognuno e' una chiamata Zoho)."""
+
+    def __init__(self, *args, on_retry=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_retry = on_retry
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.on_retry = self.on_retry
+        return retry
+
+    def increment(self, *args, **kwargs):
+        # Solleva MaxRetryError a tentativi esauriti: in quel caso nessuna chiamata
+        retry = super().increment(*args, **kwargs)
+        if self.on_retry:
+            self.on_retry()
+        return retry
+
 
 class ZohoAPIError(Exception):
     """Errore API Zoho"""
@@ -37,14 +81,44 @@ class ZohoAPI:
         self.app = config.get("app") or os.environ.get("ZOHO_APP", "service-management")
         self.form = config.get("form") or os.environ.get("ZOHO_FORM", "Pianificazione")
         self.report = config.get("report") or os.environ.get("ZOHO_REPORT", "CalendarioPianificazione")
+        self.page_size = int(os.environ.get("ZOHO_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+
+        # Sessioni HTTP persistenti (keep-alive), una per host
+        self.pool_size = int(os.environ.get("ZOHO_POOL_SIZE", "4"))
+        self.max_retries = int(os.environ.get("ZOHO_MAX_RETRIES", "3"))
+        self.retry_backoff = float(os.environ.get("ZOHO_RETRY_BACKOFF", "0.5"))
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+        # Budget giornaliero chiamate Creator (0 = solo conteggio)
+        self.budget = CallBudget(
+            daily_quota=int(os.environ.get("ZOHO_DAILY_QUOTA", "0")),
+            write_reserve=float(os.environ.get("ZOHO_WRITE_RESERVE", "0.1")),
+            low_threshold=float(os.environ.get("ZOHO_BUDGET_LOW", "0.2")),
+        )
+        self._category = threading.local()
+
+        # Letture identiche concorrenti condividono una sola richiesta
+        self._inflight = RequestCoalescer(
+            on_shared=lambda key: metrics.ZOHO_COALESCED.inc(kind=key[0]),
+        )
 
         self._access_token = None
         self._token_expires_at = 0
 
+        # Refresh single-flight: un solo refresh alla volta, esito condiviso
+        self._token_lock = threading.Lock()
+        self._refresh_gen = 0
+        self._refresh_error = None
+        self._refresh_timer = None
+
         self._load_cached_token()
+        if self._access_token and self.refresh_token:
+            self._schedule_proactive_refresh()
 
     def reconfigure(self, config):
         """Aggiorna credenziali senza riavvio."""
+        old_dc = self.dc
         self.dc = config.get("dc", self.dc)
         self.client_id = config.get("client_id", self.client_id)
         self.client_secret = config.get("client_secret", self.client_secret)
@@ -54,10 +128,25 @@ class ZohoAPI:
         self.form = config.get("form", self.form)
         self.report = config.get("report", self.report)
         # Invalida token corrente per forzare rigenerazione
-        self._access_token = None
-        self._token_expires_at = 0
+        with self._token_lock:
+            self._access_token = None
+            self._token_expires_at = 0
+            self._refresh_error = None
+        self._cancel_proactive_refresh()
+        # Cambio data center: le connessioni verso i vecchi host non servono piu'
+        if self.dc != old_dc:
+            self.close()
         logger.info("ZohoAPI riconfigurato")
 
+    def close(self):
+        """Chiude le sessioni HTTP e le relative connessioni."""
+        self._cancel_proactive_refresh()
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
     @property
     def _base_url(self):
         return f"https://creator.zoho.{self.dc}/api/v2.1/{self.owner}/{self.app}"
@@ -66,6 +155,102 @@ class ZohoAPI:
     def _accounts_url(self):
         return f"https://accounts.zoho.{self.dc}/oauth/v2/token"
 
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    def _session(self, url):
+        """Restituisce la sessione persistente per l'host dell'URL."""
+        host = urlsplit(url).netloc
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._build_session(host)
+                self._sessions[host] = session
+            return session
+
+    def _build_session(self, host):
+        # POST ritentabile solo verso accounts (refresh token idempotente):
+        # su Creator un POST ripetuto potrebbe creare record duplicati
+        methods = {"GET", "PATCH", "DELETE"}
+        if host.startswith("accounts."):
+            methods.add("POST")
+        retry = _BudgetRetry(
+            on_retry=self._record_retry,
+            total=self.max_retries,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(methods),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.headers["Connection"] = "keep-alive"
+        session.mount(f"https://{host}", adapter)
+        logger.debug("Sessione HTTP creata per %s (pool %d)", host, self.pool_size)
+        return session
+
+    @contextmanager
+    def call_category(self, category):
+        """Attribuisce al budget le chiamate del thread corrente (es. "sync")."""
+        previous = getattr(self._category, "name", None)
+        self._category.name = category
+        try:
+            yield
+        finally:
+            self._category.name = previous
+
+    def _call_category(self, method, url):
+        if urlsplit(url).netloc.startswith("accounts."):
+            return "token"
+        if method != "GET":
+            return "write"
+        return getattr(self._category, "name", None) or "read"
+
+    def _request(self, method, url, **kwargs):
+        category = self._call_category(method, url)
+        if not self.budget.allow(category):
+            raise ZohoAPIError(
+                f"Budget API Zoho giornaliero esaurito (categoria {category})",
+                status_code=429,
+            )
+        self.budget.record(category)
+        self._category.charged = category
+
+        endpoint = self._endpoint_label(url)
+        status = "error"
+        start = time.perf_counter()
+        try:
+            resp = self._session(url).request(method, url, **kwargs)
+            status = resp.status_code
+            return resp
+        finally:
+            metrics.ZOHO_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, endpoint=endpoint, method=method,
+            )
+            metrics.ZOHO_RESPONSES.inc(endpoint=endpoint, method=method, status=status)
+
+    def _record_retry(self):
+        """Addebita al budget un tentativo ripetuto dall'adapter (stesso thread)."""
+        self.budget.record(getattr(self._category, "charged", None) or "read")
+
+    def _endpoint_label(self, url):
+        """Etichetta a bassa cardinalita' per le metriche (senza ID record)."""
+        path = urlsplit(url).path
+        if path.startswith("/oauth/"):
+            return "oauth_token"
+        if "/form/" in path:
+            return "form"
+        if "/report/" in path:
+            tail = path.split("/report/", 1)[1].strip("/")
+            return "report_record" if "/" in tail else "report"
+        return "other"
+
     # ------------------------------------------------------------------
     # Token management
     # ------------------------------------------------------------------
@@ -85,28 +270,65 @@ class ZohoAPI:
             pass
 
     def _save_cached_token(self):
-        """Salva token nella cache su disco."""
+        """Salva token nella cache su disco (scrittura atomica)."""
+        tmp_file = f"{TOKEN_CACHE_FILE}.tmp"
         try:
             os.makedirs(os.path.dirname(TOKEN_CACHE_FILE), exist_ok=True)
-            with open(TOKEN_CACHE_FILE, "w") as f:
+            with open(tmp_file, "w") as f:
                 json.dump({
                     "access_token": self._access_token,
                     "expires_at": self._token_expires_at,
                 }, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, TOKEN_CACHE_FILE)
         except OSError as e:
             logger.warning("Impossibile salvare cache token: %s", e)
 
     def get_access_token(self):
         """Ottiene un access token valido, rigenerandolo se necessario."""
-        if self._access_token and time.time() < self._token_expires_at:
+        if self._token_valid():
             return self._access_token
-
+        return self._refresh_access_token()
+
+    def _token_valid(self):
+        return bool(self._access_token) and time.time() < self._token_expires_at
+
+    def _refresh_access_token(self, proactive=False):
+        """Rinnova il token: i thread concorrenti attendono e ne condividono l'esito."""
+        gen = self._refresh_gen
+        with self._token_lock:
+            if self._refresh_gen != gen:
+                # Refresh appena completato da un altro thread
+                if self._refresh_error is not None:
+                    raise self._refresh_error
+                if self._token_valid():
+                    return self._access_token
+            elif not proactive and self._token_valid():
+                return self._access_token
+
+            try:
+                token = self._request_access_token()
+                self._refresh_error = None
+                metrics.TOKEN_REFRESHES.inc(result="ok")
+            except ZohoAPIError as e:
+                self._refresh_error = e
+                metrics.TOKEN_REFRESHES.inc(result="error")
+                raise
+            finally:
+                self._refresh_gen += 1
+
+        self._schedule_proactive_refresh()
+        return token
+
+    def _request_access_token(self):
+        """Chiama accounts.zoho per un nuovo access token (lock gia' acquisito)."""
         if not self.refresh_token:
             raise ZohoAPIError("Refresh token non configurato")
 
         logger.info("Rigenerazione access token...")
         try:
-            resp = requests.post(self._accounts_url, data={
+            resp = self._request("POST", self._accounts_url, data={
                 "grant_type": "refresh_token",
                 "client_id": self.client_id,
                 "client_secret": self.client_secret,
@@ -122,6 +344,8 @@ class ZohoAPI:
                 )
 
             data = resp.json()
+            if "access_token" not in data:
+                raise ZohoAPIError(f"Errore refresh token: {data.get('error', data)}")
             self._access_token = data["access_token"]
             expires_in = data.get("expires_in", 3600)
             self._token_expires_at = int(time.time()) + expires_in - 60
@@ -132,6 +356,32 @@ class ZohoAPI:
         except requests.RequestException as e:
             raise ZohoAPIError(f"Errore di rete: {e}")
 
+    def _schedule_proactive_refresh(self, delay=None):
+        """Programma il rinnovo in background poco prima della scadenza."""
+        if delay is None:
+            delay = self._token_expires_at - TOKEN_REFRESH_MARGIN - time.time()
+        self._cancel_proactive_refresh()
+        timer = threading.Timer(max(delay, 30), self._proactive_refresh)
+        timer.daemon = True
+        timer.start()
+        self._refresh_timer = timer
+
+    def _cancel_proactive_refresh(self):
+        timer, self._refresh_timer = self._refresh_timer, None
+        if timer:
+            timer.cancel()
+
+    def _proactive_refresh(self):
+        if not self.refresh_token:
+            return
+        try:
+            self._refresh_access_token(proactive=True)
+        except ZohoAPIError as e:
+            logger.warning("Rinnovo anticipato token fallito: %s", e)
+            # Il token corrente e' ancora valido per qualche minuto: riprova
+            if self._token_valid():
+                self._schedule_proactive_refresh(delay=60)
+
     def _headers(self):
         token = self.get_access_token()
         return {
@@ -153,7 +403,7 @@ class ZohoAPI:
             redirect_uri = os.environ.get("ZOHO_REDIRECT_URI", "http://localhost:3000/auth/callback")
         logger.info("Scambio codice autorizzazione...")
         try:
-            resp = requests.post(self._accounts_url, data={
+            resp = self._request("POST", self._accounts_url, data={
                 "grant_type": "authorization_code",
                 "client_id": self.client_id,
                 "client_secret": self.client_secret,
@@ -194,45 +444,109 @@ class ZohoAPI:
     # Read operations
     # ------------------------------------------------------------------
 
-    def get_events_by_date(self, target_date=None):
-        """Legge eventi dal report CalendarioPianificazione per una data."""
-        if target_date is None:
-            target_date = date.today()
-        elif isinstance(target_date, str):
-            target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
+    def iter_records(self, criteria=None, page_size=None):
+        """Generatore di pagine di record dal report.
 
-        date_str = target_date.strftime("%Y-%m-%d")
+        Usa la paginazione v2.1 (header record_cursor): ogni iterazione
+        restituisce la lista di record di una pagina, fino ad esaurimento.
+        """
         url = f"{self._base_url}/report/{self.report}"
-        params = {
-            "criteria": f'(Data=="{date_str}")',
-            "from": 1,
-            "limit": 200,
-        }
-
-        logger.info("Caricamento eventi per %s...", date_str)
-        try:
-            resp = requests.get(url, headers=self._headers(),
-                                params=params, timeout=15)
-            if resp.status_code == 200:
-                data = resp.json()
-                events = data.get("data", [])
-                logger.info("Trovati %d eventi per %s", len(events), date_str)
-                return events
-            elif resp.status_code == 204:
-                logger.info("Nessun evento per %s", date_str)
-                return []
-            else:
+        params = {"max_records": page_size or self.page_size}
+        if criteria:
+            params["criteria"] = criteria
+
+        cursor = None
+        page = 0
+        while True:
+            headers = self._headers()
+            if cursor:
+                headers["record_cursor"] = cursor
+            try:
+                resp = self._request("GET", url, headers=headers,
+                                     params=params, timeout=30)
+            except requests.RequestException as e:
+                raise ZohoAPIError(f"Errore di rete: {e}")
+
+            if resp.status_code == 204:
+                return
+            if resp.status_code != 200:
                 raise ZohoAPIError(
                     f"Errore lettura report: {resp.status_code} {resp.text}",
                     status_code=resp.status_code,
                 )
-        except requests.RequestException as e:
-            raise ZohoAPIError(f"Errore di rete: {e}")
+
+            records = resp.json().get("data", [])
+            page += 1
+            logger.debug("Pagina %d: %d record (%s)", page, len(records), criteria)
+            if records:
+                yield records
+
+            cursor = resp.headers.get("record_cursor")
+            if not cursor or not records:
+                return
+
+    def fetch_records(self, criteria, kind="records"):
+        """Tutti i record che soddisfano `criteria`, in un'unica lista.
+
+        Le chiamate concorrenti con gli stessi criteri condividono la stessa
+        richiesta e la stessa lista (da non modificare).
+        """
+        def _fetch():
+            records = []
+            for page in self.iter_records(criteria):
+                records.extend(page)
+            return records
+
+        return self._inflight.run((kind, criteria), _fetch)
+
+    def get_events_in_range(self, start_date, end_date):
+        """Legge tutti gli eventi tra due date (estremi inclusi)."""
+        events = self.fetch_records(
+            self._range_criteria(start_date, end_date), kind="range",
+        )
+        logger.info(
+            "Trovati %d eventi tra %s e %s",
+            len(events), self._to_date(start_date), self._to_date(end_date),
+        )
+        return events
+
+    def iter_modified_since(self, since):
+        """Generatore di pagine di record modificati dopo `since` (datetime)."""
+        since_str = since.strftime(CRITERIA_DATETIME_FORMAT)
+        return self.iter_records(f'(Modified_Time >= "{since_str}")')
+
+    def get_events_by_date(self, target_date=None):
+        """Legge eventi dal report CalendarioPianificazione per una data."""
+        if target_date is None:
+            target_date = date.today()
+        date_str = self._to_date(target_date).strftime("%Y-%m-%d")
+
+        logger.info("Caricamento eventi per %s...", date_str)
+        events = self.fetch_records(f'(Data=="{date_str}")', kind="date")
+        if events:
+            logger.info("Trovati %d eventi per %s", len(events), date_str)
+        else:
+            logger.info("Nessun evento per %s", date_str)
+        return events
 
     def get_today_events(self):
         """Scorciatoia per eventi di oggi."""
         return self.get_events_by_date(date.today())
 
+    @classmethod
+    def _range_criteria(cls, start_date, end_date):
+        start_str = cls._to_date(start_date).strftime("%Y-%m-%d")
+        end_str = cls._to_date(end_date).strftime("%Y-%m-%d")
+        return f'(Data >= "{start_str}" && Data <= "{end_str}")'
+
+    @staticmethod
+    def _to_date(value):
+        if isinstance(value, str):
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
     # ------------------------------------------------------------------
     # Write operations
     # ------------------------------------------------------------------
@@ -244,7 +558,7 @@ class ZohoAPI:
 
         logger.info("Creazione evento: %s", data.get("Titolo", "?"))
         try:
-            resp = requests.post(url, headers=self._headers(),
+            resp = self._request("POST", url, headers=self._headers(),
                                  json=payload, timeout=15)
             if resp.status_code in (200, 201):
                 result = resp.json()
@@ -263,6 +577,52 @@ class ZohoAPI:
         except requests.RequestException as e:
             raise ZohoAPIError(f"Errore di rete: {e}")
 
+    def create_events(self, records):
+        """Crea piu' eventi con inserimenti multipli (max BULK_INSERT_LIMIT per richiesta).
+
+        Restituisce un risultato per record, nello stesso ordine dell'input:
+        il dict di Zoho (code/data/message oppure code/error). Un blocco
+        fallito marca in errore solo i propri record: gli esiti dei blocchi
+        gia' inviati restano validi.
+        """
+        url = f"{self._base_url}/form/{self.form}"
+        results = []
+        for start in range(0, len(records), BULK_INSERT_LIMIT):
+            chunk = records[start:start + BULK_INSERT_LIMIT]
+            logger.info(
+                "Creazione multipla: record %d-%d di %d",
+                start + 1, start + len(chunk), len(records),
+            )
+            try:
+                results.extend(self._create_chunk(url, chunk))
+            except ZohoAPIError as e:
+                logger.error(
+                    "Creazione multipla: record %d-%d non creati: %s",
+                    start + 1, start + len(chunk), e,
+                )
+                results.extend({"code": e.status_code, "error": str(e)} for _ in chunk)
+        return results
+
+    def _create_chunk(self, url, chunk):
+        try:
+            resp = self._request("POST", url, headers=self._headers(),
+                                 json={"data": chunk}, timeout=60)
+        except requests.RequestException as e:
+            raise ZohoAPIError(f"Errore di rete: {e}")
+
+        if resp.status_code not in (200, 201):
+            raise ZohoAPIError(
+                f"Errore creazione multipla: {resp.status_code} {resp.text}",
+                status_code=resp.status_code,
+            )
+        result = resp.json().get("result", [])
+        if len(result) != len(chunk):
+            raise ZohoAPIError(
+                f"Risposta creazione multipla inattesa: {len(result)} "
+                f"risultati per {len(chunk)} record",
+                status_code=resp.status_code,
+            )
+        return result
 
     def update_event(self, record_id, data):
         """Aggiorna un evento esistente."""
@@ -271,8 +631,8 @@ class ZohoAPI:
 
         logger.info("Aggiornamento evento %s", record_id)
         try:
-            resp = requests.patch(url, headers=self._headers(),
-                                  json=payload, timeout=15)
+            resp = self._request("PATCH", url, headers=self._headers(),
+                                 json=payload, timeout=15)
             if resp.status_code == 200:
                 result = resp.json()
                 logger.info("Evento aggiornato: %s", result)
@@ -291,7 +651,8 @@ class ZohoAPI:
 
         logger.info("Eliminazione evento %s", record_id)
         try:
-            resp = requests.delete(url, headers=self._headers(), timeout=15)
+            resp = self._request("DELETE", url, headers=self._headers(),
+                                 timeout=15)
             if resp.status_code == 200:
                 result = resp.json()
                 logger.info("Evento eliminato: %s", result)